@@ -1,8 +1,5 @@
-while true;
-do
-	${XL_IDP_ROOT_EXPORT}/bash_dir/flat_export.sh;
-	${XL_IDP_ROOT_EXPORT}/bash_dir/export_grain.sh;
-	${XL_IDP_ROOT_EXPORT}/bash_dir/report_order.sh;
-	${XL_IDP_ROOT_EXPORT}/bash_dir/report_orders_update.sh;
-	sleep 1;
-done
\ No newline at end of file
+#!/bin/bash
+
+# One resident process watches all the directories and keeps the parsers warm
+# and runs enrichment.py, which updates the deferred lookups in ClickHouse, while CONSIGNMENTS_DEFERRED_PATH is set
+exec python3 ${XL_IDP_ROOT_EXPORT}/scripts/daemon.py flat_export export_grain report_order report_orders_update
@@ -11,6 +11,18 @@ logger.add(f"file_{time.strftime('%Y-%m-%d')}.log", format="{time} {level} {file
 
 load_dotenv()
 
+DATA_DIR: str = os.path.abspath(
+    os.environ.get("XL_IDP_DATA_EXPORT") or os.path.join(os.environ.get("XL_IDP_PATH_EXPORT", ""), "data")
+)
+
+
+def get_data_path(path: str) -> str:
+    """
+    Put a relative path into DATA_DIR, so every process and every new container use the same files.
+    Empty stays empty.
+    """
+    return os.path.join(DATA_DIR, path) if path else ""
+
 
 def get_my_env_var(var_name: str) -> str:
     try:
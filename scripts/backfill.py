@@ -0,0 +1,171 @@
+"""
+Reprocessing of archived files in a pool of processes.
+
+The files of the directories or globs are parsed by the parser of the source, in the order of the month at the
+beginning of their names, and are left in place. The rows of reference_lines are loaded once and passed to every
+worker, the workers share the sqlite caches of the consignments and of the workbooks. Every finished file is
+appended to the checkpoint, the files done in the checkpoint are skipped when the backfill is run again:
+
+    python3 scripts/backfill.py report_order /data/report_orders/flat_report_orders/done --since 2023.01 \
+        --until 2023.12 --workers 8 --sink clickhouse
+"""
+import os
+import glob
+import json
+import time
+import fnmatch
+import argparse
+import multiprocessing
+from datetime import date
+from __init__ import logger
+from dates import date_from_file_name
+from daemon import FILE_PATTERNS, SOURCE_NAMES
+from typing import Dict, List, Optional, Set, Tuple
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+ENRICHED_SOURCES: tuple = ("flat_export", "report_order")
+SERIAL_SOURCES: tuple = ("report_orders_update",)
+
+
+def get_parser(name: str) -> type:
+    if name == "flat_export":
+        from flat_export import Export
+        return Export
+    if name == "export_grain":
+        from export_grain import ExportGrain
+        return ExportGrain
+    if name == "report_order":
+        from report_order import Report_Order
+        return Report_Order
+    from report_orders_update import Report_Order_Update
+    return Report_Order_Update
+
+
+def get_month(file_path: str) -> Optional[date]:
+    try:
+        return date_from_file_name(file_path)
+    except ValueError:
+        return None
+
+
+def find_files(paths: List[str], since: Optional[date], until: Optional[date]) -> List[str]:
+    """
+    Find the files of the directories and globs whose month is in the range, the oldest month first.
+    """
+    found: Set[str] = set()
+    for path in paths:
+        names: list = glob.glob(os.path.join(path, "*") if os.path.isdir(path) else path)
+        for file_path in names:
+            name: str = os.path.basename(file_path)
+            if not os.path.isfile(file_path) or "error_" in name:
+                continue
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in FILE_PATTERNS):
+                found.add(os.path.abspath(file_path))
+    files: list = []
+    for file_path in found:
+        month: Optional[date] = get_month(file_path)
+        if (since or until) and month is None:
+            logger.info(f"Skip the file {file_path}, there is no month in its name")
+            continue
+        if (since and month < since) or (until and month > until):
+            continue
+        files.append((month or date.min, os.path.basename(file_path), file_path))
+    return [file_path for _, _, file_path in sorted(files)]
+
+
+def read_checkpoint(checkpoint_path: str) -> Set[str]:
+    """
+    Get the files already done by the previous runs.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path, encoding="utf-8") as f:
+        for line in f:
+            record: dict = json.loads(line)
+            if record["status"] == "done":
+                done.add(record["file_path"])
+    return done
+
+
+def init_worker(line_unified: Optional[list]) -> None:
+    """
+    Use the snapshot of reference_lines of the backfill instead of loading it in every worker.
+    """
+    if line_unified is not None:
+        from parsed import REFERENCE_LINES
+        REFERENCE_LINES.use_snapshot(line_unified)
+
+
+def process_file(name: str, file_path: str, output_folder: str) -> Tuple[str, float]:
+    """
+    Parse the file in a worker, return the status and the seconds.
+    """
+    start: float = time.time()
+    try:
+        get_parser(name)(file_path, output_folder).main()
+    except (Exception, SystemExit) as ex:
+        logger.exception(f"Error processing the file {file_path} : {ex}")
+        return "error", time.time() - start
+    return "done", time.time() - start
+
+
+def run(name: str, files: List[str], output_folder: str, workers: int, checkpoint_path: str) -> Dict[str, int]:
+    """
+    Parse the files in the pool and append every finished file to the checkpoint.
+    """
+    line_unified: Optional[list] = None
+    if name in ENRICHED_SOURCES:
+        from clickhouse import get_clickhouse
+        from parsed import fetch_reference_lines
+        line_unified = fetch_reference_lines(get_clickhouse())
+    os.makedirs(output_folder, exist_ok=True)
+    statuses: Dict[str, int] = {"done": 0, "error": 0}
+    context = multiprocessing.get_context("spawn")
+    pending: List[str] = list(reversed(files))
+    in_flight: Dict[Future, str] = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                             initargs=(line_unified,)) as executor, \
+            open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        while pending or in_flight:
+            while pending and len(in_flight) < workers * 2:
+                file_path: str = pending.pop()
+                in_flight[executor.submit(process_file, name, file_path, output_folder)] = file_path
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                file_path = in_flight.pop(future)
+                status, seconds = future.result()
+                statuses[status] += 1
+                checkpoint.write(json.dumps({"file_path": file_path, "status": status, "seconds": round(seconds, 3),
+                                             "finished_at": time.strftime("%Y-%m-%d %H:%M:%S")}, ensure_ascii=False))
+                checkpoint.write("\n")
+                checkpoint.flush()
+            logger.info(f"Backfill: {statuses['done']} done, {statuses['error']} errors, "
+                        f"{len(pending) + len(in_flight)} left")
+    return statuses
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Reprocessing of archived files in a pool of processes")
+    argument_parser.add_argument("source", choices=SOURCE_NAMES, help="parser of the files")
+    argument_parser.add_argument("paths", nargs="+", help="directories or globs of the files")
+    argument_parser.add_argument("--since", help="first month of the names of the files, as 2023.01")
+    argument_parser.add_argument("--until", help="last month of the names of the files, as 2023.12")
+    argument_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of processes")
+    argument_parser.add_argument("--sink", choices=("json", "clickhouse"),
+                                 default=os.environ.get("OUTPUT_SINK", "json"),
+                                 help="json files in the output folder or inserts into ClickHouse")
+    argument_parser.add_argument("--output", default="backfill_json", help="folder of the json files")
+    argument_parser.add_argument("--checkpoint", default="backfill_checkpoint.jsonl",
+                                 help="json lines of the finished files, the done files are skipped")
+    args = argument_parser.parse_args()
+    os.environ["OUTPUT_SINK"] = args.sink
+    done: Set[str] = read_checkpoint(args.checkpoint)
+    since: Optional[date] = date_from_file_name(args.since) if args.since else None
+    until: Optional[date] = date_from_file_name(args.until) if args.until else None
+    backfill_files: List[str] = [
+        file_path for file_path in find_files(args.paths, since, until) if file_path not in done
+    ]
+    workers: int = 1 if args.source in SERIAL_SOURCES else args.workers
+    logger.info(f"Backfill of {len(backfill_files)} files, {len(done)} done before, {workers} workers")
+    logger.info(f"Backfill finished: {run(args.source, backfill_files, args.output, workers, args.checkpoint)}")
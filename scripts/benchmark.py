@@ -0,0 +1,231 @@
+"""
+Benchmark of the parsers on synthetic workbooks.
+
+Every run parses a generated workbook end-to-end in a fresh process, against a local mock of the consignments
+microservice and a fake ClickHouse client, and appends the wall time, the times of the stages and the peak
+memory to a results file in the json lines format:
+
+    python3 scripts/benchmark.py --sizes 1000,100000 --results benchmark.jsonl
+"""
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import datetime
+import openpyxl
+import subprocess
+import multiprocessing
+from typing import Callable, Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from mock_consignments import LINES, MockConsignmentsServer, MockSettings, start_server
+
+SIZES: tuple = (1000, 10000, 100000, 500000)
+REFERENCE_LINES: list = [(line, line) for line in LINES[:5]] + [("MSC LINE", "MSC"), ("SKR", "SINOKOR")]
+FLAT_EXPORT_HEADERS: tuple = (
+    "Терминал", "Линия", "Дата отгрузки", "Количество", "Размер контейнера", "TEU", "Тип контейнера",
+    "Порт выгрузки", "Страна выгрузки", "Судно", "Рейс", "Контейнер из партии", "Отправитель", "Получатель",
+    "Наименование товара", "Номер коносамента", "Экспедитор", "ИНН Грузоотправителя", "ТНВЭД"
+)
+
+
+class FakeResult(object):
+    def __init__(self, result_rows: list):
+        self.result_rows: list = result_rows
+
+
+class FakeClickHouseClient(object):
+    """
+    Answers the queries of the parsers without a server.
+    """
+
+    def query(self, query: str, *args, **kwargs) -> FakeResult:
+        if "system.parts" in query:
+            return FakeResult([(1,)])
+        if "reference_lines" in query:
+            return FakeResult(REFERENCE_LINES)
+        if "system.columns" in query:
+            from report_orders_update import UPDATE_COLUMNS
+            return FakeResult([(column, "Nullable(String)") for column, _ in UPDATE_COLUMNS])
+        return FakeResult([])
+
+    def command(self, *args, **kwargs) -> None:
+        pass
+
+    def insert_df(self, *args, **kwargs) -> None:
+        pass
+
+    def ping(self) -> bool:
+        return True
+
+
+def get_date(i: int) -> datetime.datetime:
+    return datetime.datetime(2024, 1, 1) + datetime.timedelta(days=i % 365, hours=i % 24)
+
+
+def write_workbook(file_path: str, header: list, rows, title: bool = False) -> None:
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    if title:
+        sheet.append(["Отчет по поручениям"])
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(file_path)
+
+
+def generate_flat_export(file_path: str, size: int) -> None:
+    write_workbook(file_path, list(FLAT_EXPORT_HEADERS), (
+        ["НУТЭП", LINES[i % len(LINES)], get_date(i).strftime("%Y-%m-%d"), 1, 40 if i % 3 else 20, 2 if i % 3 else 1,
+         "HC", None if i % 4 else "ROTTERDAM", "НИДЕРЛАНДЫ", f"SHIP {i % 50}", f"{i % 900}E",
+         f"MSCU{i:07d}", f"ООО ОТПРАВИТЕЛЬ {i % 1000} ", f"CONSIGNEE {i % 700}",
+         "ПОРОЖНИЙ КОНТЕЙНЕР" if i % 7 == 0 else f"ГРУЗ {i % 300}", f"BL{i // 3:08d}", f"ЭКСПЕДИТОР {i % 40}",
+         f"{7700000000 + i % 5000}", f"{8400000000 + i % 2000}"]
+        for i in range(size)
+    ))
+
+
+def generate_export_grain(file_path: str, size: int, long_headers: bool) -> None:
+    from export_grain import HEADERS_ENG
+    header: list = [columns[0] if long_headers else columns[-1] for columns in HEADERS_ENG]
+    write_workbook(file_path, header, (
+        [get_date(i).strftime("%d.%m.%Y"), f"ЗАКАЗЧИК {i % 200}", f"ПШЕНИЦА {i % 5} КЛАССА", f"ОТПРАВИТЕЛЬ {i % 300}",
+         f"RECEIVER {i % 400}", "Ж/Д" if i % 2 else "АВТО", round(60 + i % 10 * 0.5, 1), f"ТЕРМИНАЛ {i % 10}, ИНН",
+         f"ТЕРМИНАЛ {i % 10}", f"АДРЕС {i % 10}", "РОССИЯ", "ЕГИПЕТ" if i % 3 else "ТУРЦИЯ"]
+        for i in range(size)
+    ))
+
+
+def generate_report_order(file_path: str, size: int) -> None:
+    from report_order import HEADERS_ENG
+    write_workbook(file_path, [columns[0] for columns in HEADERS_ENG], (
+        [get_date(i), f"П{i}", get_date(i).strftime("%d.%m.%Y"), f"ЭКСПЕДИТОР {i % 40}", f"{i % 900}E", "MSCU",
+         f"{i:07d}", "22G1 20" if i % 3 else "45G1 40", None if i % 5 == 0 else f"ГРУЗ {i % 300}", None, 2200,
+         1000.5, 3200, get_date(i), get_date(i + 1), "ROTTERDAM", f"SHIP {i % 50}", LINES[i % len(LINES)],
+         f"D{i}", "ДТ", get_date(i), "Э", f"{8400000000 + i % 2000}", None, f"CONSIGNEE {i % 700}",
+         f"SHIPPER {i % 1000}", None, "ВЫПОЛНЕНО", None]
+        for i in range(size)
+    ), title=True)
+
+
+def generate_report_orders_update(file_path: str, size: int) -> None:
+    from report_orders_update import DATE_COLUMNS, UPDATE_COLUMNS
+
+    def get_value(i: int, column: str, quoted: bool):
+        if column in DATE_COLUMNS:
+            return get_date(i).strftime("%Y-%m-%d")
+        if column in ("is_auto_tracking", "is_auto_tracking_ok"):
+            return i % 2
+        return f"{column} {i % 100}" if quoted else i % 100
+
+    write_workbook(file_path, ["uuid"] + [column for column, _ in UPDATE_COLUMNS], (
+        [f"00000000-0000-0000-0000-{i:012d}"] + [get_value(i, column, quoted) for column, quoted in UPDATE_COLUMNS]
+        for i in range(size)
+    ))
+
+
+GENERATORS: Dict[str, Callable[[str, int], None]] = {
+    "flat_export": generate_flat_export,
+    "export_grain_long": lambda file_path, size: generate_export_grain(file_path, size, True),
+    "export_grain_short": lambda file_path, size: generate_export_grain(file_path, size, False),
+    "report_order": generate_report_order,
+    "report_orders_update": generate_report_orders_update
+}
+
+
+def get_parser(name: str) -> type:
+    if name == "flat_export":
+        from flat_export import Export
+        return Export
+    if name.startswith("export_grain"):
+        from export_grain import ExportGrain
+        return ExportGrain
+    if name == "report_order":
+        from report_order import Report_Order
+        return Report_Order
+    from report_orders_update import Report_Order_Update
+    return Report_Order_Update
+
+
+def run_parser(name: str, file_path: str, output_folder: str) -> dict:
+    """
+    Parse the workbook in the process of the pool, with the fake ClickHouse client.
+    """
+    import clickhouse_connect
+    clickhouse_connect.get_client = lambda **kwargs: FakeClickHouseClient()
+    import metrics
+    parser: type = get_parser(name)
+    start: float = time.perf_counter()
+    parser(file_path, output_folder).main()
+    wall_seconds: float = time.perf_counter() - start
+    record: dict = metrics.last_record or {}
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "peak_rss_bytes": record.get("peak_rss_bytes"),
+        "stages": record.get("stages", {}),
+        "counters": record.get("counters", {})
+    }
+
+
+def get_isolated_environment() -> dict:
+    """
+    Environment of a run that keeps the caches, the queue of the deferred lookups, the ledger and the fingerprints
+    of the production away, the files of the run are put into a temporary folder.
+    """
+    state_dir: str = tempfile.mkdtemp(prefix="benchmark_")
+    return {
+        "CONSIGNMENTS_CACHE_PATH": "",
+        "CONSIGNMENTS_DEFERRED_PATH": "",
+        "WORKBOOK_CACHE_PATH": "",
+        "LEDGER_PATH": os.path.join(state_dir, "ledger.sqlite3"),
+        "FINGERPRINTS_PATH": os.path.join(state_dir, "fingerprints.sqlite3"),
+        "METRICS_TEXTFILE_DIR": ""
+    }
+
+
+def get_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run(parsers: List[str], sizes: List[int], work_dir: str, results_path: str, latency: str) -> None:
+    os.makedirs(os.path.join(work_dir, "json"), exist_ok=True)
+    server: MockConsignmentsServer = start_server(MockSettings(latency))
+    os.environ.update(get_isolated_environment())
+    os.environ["OUTPUT_SINK"] = "json"
+    for variable in ("HOST", "DATABASE", "USERNAME_DB", "PASSWORD"):
+        os.environ.setdefault(variable, "benchmark")
+    revision: str = get_revision()
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        for name in parsers:
+            file_path: str = os.path.join(work_dir, f"2024.01 {name}_{size}.xlsx")
+            if not os.path.exists(file_path):
+                random.seed(size)
+                GENERATORS[name](file_path, size)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result: dict = executor.submit(run_parser, name, file_path, os.path.join(work_dir, "json")).result()
+            result = {"revision": revision, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "parser": name,
+                      "rows": size, **result}
+            with open(results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result, ensure_ascii=False))
+                f.write("\n")
+            print(f"{name:22} {size:>8} rows {result['wall_seconds']:>9.3f} s "
+                  f"{(result['peak_rss_bytes'] or 0) / 1048576:>8.1f} MB  {result['stages']}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Benchmark of the parsers on synthetic workbooks")
+    argument_parser.add_argument("--parsers", default=",".join(GENERATORS), help="comma separated parsers")
+    argument_parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma separated numbers of rows")
+    argument_parser.add_argument("--work-dir", default="benchmark", help="folder of the workbooks and json files")
+    argument_parser.add_argument("--results", default="benchmark_results.jsonl", help="file to append the results")
+    argument_parser.add_argument("--latency", default="fixed:0", help="latency of the mock of the consignments")
+    args = argument_parser.parse_args()
+    run(args.parsers.split(","), [int(size) for size in args.sizes.split(",")], args.work_dir, args.results,
+        args.latency)
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+STRING_KINDS: tuple = ("string", "mixed", "mixed-integer")
+
+
+def strip_strings(df: DataFrame) -> DataFrame:
+    """
+    Strip the strings of the object columns, other values are kept as is.
+    """
+    for column in df.columns[df.dtypes == object]:
+        values = df[column]
+        if pd.api.types.infer_dtype(values, skipna=True) not in STRING_KINDS:
+            continue
+        stripped = values.str.strip()
+        df[column] = stripped.where(stripped.notna(), values)
+    return df
+
+
+def normalize_nulls(df: DataFrame) -> DataFrame:
+    """
+    Replace NaN, NaT, NA and the string "NaT" with None.
+    """
+    for column in df.columns:
+        values = df[column]
+        nulls = values.isna()
+        if values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype):
+            nulls |= values == "NaT"
+        nulls = nulls.to_numpy()
+        if nulls.any():
+            normalized: np.ndarray = values.to_numpy(dtype=object, copy=True)
+            normalized[nulls] = None
+            df[column] = pd.Series(normalized, index=df.index, dtype=object)
+    return df
+
+
+def to_nullable(values: pd.Series, dtype: str) -> pd.Series:
+    """
+    Convert the values to a nullable dtype, keep them as is if some value would be lost.
+    """
+    try:
+        return values.astype(dtype)
+    except (TypeError, ValueError):
+        return values
+
+
+def apply_dtypes(df: DataFrame, dtypes: dict) -> DataFrame:
+    """
+    Convert the columns to compact dtypes: category, date (ISO strings kept as categories), Int64 and boolean.
+    The nulls stay NaN or NA until the rows are written.
+    """
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if dtype in ("category", "date"):
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                df[column] = values.astype("category")
+        elif values.dtype != dtype:
+            df[column] = to_nullable(values, dtype)
+    return df
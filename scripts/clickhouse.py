@@ -0,0 +1,103 @@
+import os
+import time
+import random
+import threading
+import clickhouse_connect
+from metrics import count
+from typing import Optional
+from clickhouse_connect.driver import Client
+from __init__ import get_my_env_var, logger
+from clickhouse_connect.driver.httputil import get_pool_manager
+from clickhouse_connect.driver.exceptions import OperationalError
+
+CLICKHOUSE_COMPRESSION: str = os.environ.get("CLICKHOUSE_COMPRESSION", "lz4")
+CLICKHOUSE_POOL_SIZE: int = int(os.environ.get("CLICKHOUSE_POOL_SIZE", 8))
+CLICKHOUSE_ATTEMPTS: int = int(os.environ.get("CLICKHOUSE_ATTEMPTS", 5))
+CLICKHOUSE_BACKOFF: float = float(os.environ.get("CLICKHOUSE_BACKOFF", 1))
+CLICKHOUSE_PING_INTERVAL: float = float(os.environ.get("CLICKHOUSE_PING_INTERVAL", 60))
+
+
+class ClickHouseConnection(object):
+    """
+    Client of ClickHouse shared by the process: connected on first use, with compression and a pool of HTTP sessions.
+    A client idle for ping_interval seconds is pinged before it is used, and replaced if it does not answer.
+    Connecting, queries and commands are retried with a jittered backoff on network errors,
+    inserts are not, the writer retries them with its deduplication token.
+    """
+
+    def __init__(self, attempts: int = CLICKHOUSE_ATTEMPTS, backoff: float = CLICKHOUSE_BACKOFF,
+                 ping_interval: float = CLICKHOUSE_PING_INTERVAL):
+        self.attempts: int = attempts
+        self.backoff: float = backoff
+        self.ping_interval: float = ping_interval
+        self.client: Optional[Client] = None
+        self.pid: int = 0
+        self.used_at: float = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def wait(self, attempt: int, ex: Exception) -> None:
+        if attempt + 1 == self.attempts:
+            raise ex
+        logger.error(f"ClickHouse is unavailable, attempt {attempt + 1} : {ex}")
+        count("clickhouse_retries")
+        time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def connect(self) -> Client:
+        for attempt in range(self.attempts):
+            try:
+                client: Client = clickhouse_connect.get_client(
+                    host=get_my_env_var('HOST'), database=get_my_env_var('DATABASE'),
+                    username=get_my_env_var('USERNAME_DB'), password=get_my_env_var('PASSWORD'),
+                    compress=CLICKHOUSE_COMPRESSION, pool_mgr=get_pool_manager(maxsize=CLICKHOUSE_POOL_SIZE)
+                )
+                logger.info('Connection to ClickHouse is successful')
+                return client
+            except OperationalError as ex:
+                self.wait(attempt, ex)
+
+    def get_client(self) -> Client:
+        """
+        Get the connected client, a forked process connects again.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                self.client = None
+            if self.client is not None and time.time() - self.used_at > self.ping_interval and not self.client.ping():
+                logger.error("ClickHouse does not answer the ping, reconnecting")
+                self.client = None
+            if self.client is None:
+                self.client = self.connect()
+                self.pid = os.getpid()
+            self.used_at = time.time()
+            return self.client
+
+    def reset(self) -> None:
+        with self.lock:
+            self.client = None
+
+    def call(self, method: str, *args, **kwargs):
+        for attempt in range(self.attempts):
+            try:
+                return getattr(self.get_client(), method)(*args, **kwargs)
+            except OperationalError as ex:
+                self.reset()
+                self.wait(attempt, ex)
+
+    def query(self, *args, **kwargs):
+        return self.call("query", *args, **kwargs)
+
+    def command(self, *args, **kwargs):
+        return self.call("command", *args, **kwargs)
+
+    def insert_df(self, *args, **kwargs):
+        return self.get_client().insert_df(*args, **kwargs)
+
+
+_connection: ClickHouseConnection = ClickHouseConnection()
+
+
+def get_clickhouse() -> ClickHouseConnection:
+    """
+    Get the connection shared by every file and worker of the process.
+    """
+    return _connection
@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import requests
+import threading
+from metrics import count
+from __init__ import get_data_path, logger
+from typing import Dict, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+WORKERS: int = int(os.environ.get("CONSIGNMENTS_WORKERS", 8))
+NUMBER_ATTEMPTS: int = int(os.environ.get("CONSIGNMENTS_ATTEMPTS", 3))
+BACKOFF: float = float(os.environ.get("CONSIGNMENTS_BACKOFF", 1))
+TIMEOUT: float = float(os.environ.get("CONSIGNMENTS_TIMEOUT", 120))
+
+CACHE_PATH: str = get_data_path(os.environ.get("CONSIGNMENTS_CACHE_PATH", "consignments_cache.sqlite3"))
+CACHE_TTL: int = int(os.environ.get("CONSIGNMENTS_CACHE_TTL", 30 * 24 * 60 * 60))
+CACHE_NEGATIVE_TTL: int = int(os.environ.get("CONSIGNMENTS_CACHE_NEGATIVE_TTL", 24 * 60 * 60))
+CACHE_MAX_SIZE: int = int(os.environ.get("CONSIGNMENTS_CACHE_MAX_SIZE", 200000))
+CACHE_BATCH: int = 500
+
+BREAKER_THRESHOLD: int = int(os.environ.get("CONSIGNMENTS_BREAKER_THRESHOLD", 5))
+BREAKER_RESET: float = float(os.environ.get("CONSIGNMENTS_BREAKER_RESET", 60))
+
+DEFERRED_PATH: str = get_data_path(os.environ.get("CONSIGNMENTS_DEFERRED_PATH", "consignments_deferred.sqlite3"))
+DEFERRED_MAX_SIZE: int = int(os.environ.get("CONSIGNMENTS_DEFERRED_MAX_SIZE", 1000000))
+
+
+class ConsignmentsCache(object):
+    """
+    Ports of the consignments kept between files and runs.
+    Keys are the bodies sent to the microservice, a port of None is a negative result.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl: int = CACHE_TTL, negative_ttl: int = CACHE_NEGATIVE_TTL,
+                 max_size: int = CACHE_MAX_SIZE):
+        self.ttl: int = ttl
+        self.negative_ttl: int = negative_ttl
+        self.max_size: int = max_size
+        self.lock: threading.Lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection: sqlite3.Connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS consignments "
+                "(key TEXT PRIMARY KEY, port TEXT, expires_at REAL, accessed_at REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS consignments_accessed_at ON consignments (accessed_at)")
+
+    @staticmethod
+    def get_key(body: dict) -> str:
+        return json.dumps(body, ensure_ascii=False, sort_keys=True)
+
+    def get_many(self, bodies: List[dict]) -> Dict[str, Optional[str]]:
+        """
+        Get the cached ports that have not expired yet.
+        """
+        now: float = time.time()
+        keys: list = [self.get_key(body) for body in bodies]
+        ports: dict = {}
+        with self.lock, self.connection:
+            for i in range(0, len(keys), CACHE_BATCH):
+                batch: list = keys[i:i + CACHE_BATCH]
+                placeholders: str = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT key, port FROM consignments WHERE expires_at > ? AND key IN ({placeholders})",
+                    [now, *batch]
+                ).fetchall()
+                ports.update((key, json.loads(port)) for key, port in rows)
+                self.connection.execute(
+                    f"UPDATE consignments SET accessed_at = ? WHERE key IN ({placeholders})", [now, *batch]
+                )
+        return ports
+
+    def set_many(self, items: List[Tuple[dict, Optional[str]]]) -> None:
+        """
+        Save the ports and evict the least recently used ones over max_size.
+        """
+        now: float = time.time()
+        rows: list = [
+            (self.get_key(body), json.dumps(port), now + (self.ttl if port else self.negative_ttl), now)
+            for body, port in items
+        ]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO consignments VALUES (?, ?, ?, ?)", rows)
+            self.connection.execute("DELETE FROM consignments WHERE expires_at <= ?", (now,))
+            self.connection.execute(
+                "DELETE FROM consignments WHERE key IN "
+                "(SELECT key FROM consignments ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_size,)
+            )
+
+
+class DeferredLookups(object):
+    """
+    Rows of the files whose port was not looked up because the microservice did not answer
+    or the enrichment is deferred.
+    A row is found by the name of the file and the value of its consignment column.
+    The oldest rows are dropped when the queue grows over max_size.
+    """
+
+    def __init__(self, path: str = DEFERRED_PATH, max_size: int = DEFERRED_MAX_SIZE):
+        self.max_size: int = max_size
+        self.lock: threading.Lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection: sqlite3.Connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS deferred (key TEXT, body TEXT, file_name TEXT, column_name TEXT, "
+                "value TEXT, enqueued_at REAL, attempts INTEGER DEFAULT 0, "
+                "PRIMARY KEY (key, file_name, column_name, value))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS deferred_enqueued_at ON deferred (enqueued_at)")
+
+    def add(self, items: List[Tuple[dict, str, str, str]]) -> None:
+        """
+        Save the bodies with the file name, the column and the value of the rows.
+        """
+        now: float = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO deferred (key, body, file_name, column_name, value, enqueued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(ConsignmentsCache.get_key(body), json.dumps(body, ensure_ascii=False), file_name, column, value, now)
+                 for body, file_name, column, value in items]
+            )
+            size: int = self.connection.execute("SELECT count(*) FROM deferred").fetchone()[0]
+            if size > self.max_size:
+                self.connection.execute(
+                    "DELETE FROM deferred WHERE rowid IN (SELECT rowid FROM deferred ORDER BY enqueued_at LIMIT ?)",
+                    (size - self.max_size,)
+                )
+        logger.info(f"Deferred the lookup of {len(items)} rows")
+        if size > self.max_size:
+            logger.warning(f"The queue of the deferred lookups is full, dropped the {size - self.max_size} oldest rows")
+            count("deferred_dropped", size - self.max_size)
+
+    def take(self, limit: int, older_than: float = 0, max_attempts: int = 0) -> List[tuple]:
+        """
+        Get the oldest rows enqueued more than older_than seconds ago: key, body, file name, column and value.
+        The rows looked up max_attempts times are given up and deleted first.
+        """
+        with self.lock:
+            given_up: int = 0
+            if max_attempts:
+                with self.connection:
+                    given_up = self.connection.execute(
+                        "DELETE FROM deferred WHERE attempts >= ?", (max_attempts,)
+                    ).rowcount
+            rows = self.connection.execute(
+                "SELECT key, body, file_name, column_name, value FROM deferred "
+                "WHERE enqueued_at <= ? ORDER BY enqueued_at LIMIT ?",
+                (time.time() - older_than, limit)
+            ).fetchall()
+        if given_up:
+            logger.warning(f"Gave up the lookup of {given_up} deferred rows after {max_attempts} attempts")
+            count("deferred_given_up", given_up)
+        return [(key, json.loads(body), file_name, column, value) for key, body, file_name, column, value in rows]
+
+    def remove(self, rows: List[tuple]) -> None:
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM deferred WHERE key = ? AND file_name = ? AND column_name = ? AND value = ?",
+                [(key, file_name, column, value) for key, _, file_name, column, value in rows]
+            )
+
+    def postpone(self, rows: List[tuple]) -> None:
+        """
+        Put the rows at the end of the queue and count the attempt.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE deferred SET attempts = attempts + 1, enqueued_at = ? "
+                "WHERE key = ? AND file_name = ? AND column_name = ? AND value = ?",
+                [(time.time(), key, file_name, column, value) for key, _, file_name, column, value in rows]
+            )
+
+
+class CircuitBreaker(object):
+    """
+    Stops the requests to the microservice for reset_timeout seconds after threshold failures in a row,
+    then lets one request through to check whether it is back. The other requests wait for the answer of the probe,
+    at most probe_timeout seconds, and go on if the microservice is back.
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, reset_timeout: float = BREAKER_RESET,
+                 probe_timeout: float = TIMEOUT):
+        self.threshold: int = threshold
+        self.reset_timeout: float = reset_timeout
+        self.probe_timeout: float = probe_timeout
+        self.failures: int = 0
+        self.opened_at: Optional[float] = None
+        self.probing_since: Optional[float] = None
+        self.condition: threading.Condition = threading.Condition()
+
+    def allow(self) -> bool:
+        with self.condition:
+            while self.probing_since is not None:
+                remaining: float = self.probing_since + self.probe_timeout - time.monotonic()
+                if remaining <= 0:
+                    logger.error("The probe of the consignments microservice did not finish, probing again")
+                    self.probing_since = None
+                    break
+                self.condition.wait(remaining)
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing_since = time.monotonic()
+            return True
+
+    def record_success(self) -> None:
+        with self.condition:
+            if self.opened_at is not None:
+                logger.info("The consignments microservice is back, the circuit is closed")
+            self.failures, self.opened_at, self.probing_since = 0, None, None
+            self.condition.notify_all()
+
+    def record_failure(self) -> None:
+        with self.condition:
+            self.failures += 1
+            if self.probing_since is not None or (self.opened_at is None and self.failures >= self.threshold):
+                logger.error(f"The consignments microservice failed {self.failures} times in a row, "
+                             f"the circuit is open for {self.reset_timeout} seconds")
+                self.opened_at, self.probing_since = time.monotonic(), None
+                self.condition.notify_all()
+
+
+class ConsignmentsClient(object):
+    def __init__(self, url: Optional[str] = None, workers: int = WORKERS, number_attempts: int = NUMBER_ATTEMPTS,
+                 backoff: float = BACKOFF, cache: Optional[ConsignmentsCache] = None, timeout: float = TIMEOUT,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.url: str = url or f"http://{os.environ['IP_ADDRESS_CONSIGNMENTS']}:{os.environ['PORT']}"
+        self.cache: Optional[ConsignmentsCache] = cache
+        self.breaker: CircuitBreaker = breaker or CircuitBreaker(probe_timeout=timeout)
+        self.workers: int = workers
+        self.number_attempts: int = number_attempts
+        self.backoff: float = backoff
+        self.timeout: float = timeout
+        self.session: requests.Session = requests.Session()
+        adapter: HTTPAdapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    def fetch_port(self, body: dict) -> Tuple[Optional[str], bool]:
+        """
+        Get the port of the consignment with exponential backoff and full jitter between attempts.
+        The flag is False when the microservice did not answer or the circuit is open.
+        """
+        for attempt in range(self.number_attempts):
+            if not self.breaker.allow():
+                count("consignments_short_circuited")
+                return None, False
+            try:
+                count("consignments_requests")
+                response = self.session.post(self.url, data=json.dumps(body), timeout=self.timeout)
+                response.raise_for_status()
+                port = response.json()
+            except Exception as ex:
+                logger.error(f"Exception is {ex}. Body is {body}")
+                self.breaker.record_failure()
+                if attempt + 1 < self.number_attempts:
+                    count("consignments_retries")
+                    time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                continue
+            self.breaker.record_success()
+            return port, True
+        count("consignments_failures")
+        return None, False
+
+    def get_port(self, body: dict) -> Optional[str]:
+        return self.fetch_port(body)[0]
+
+    def get_ports(self, bodies: List[dict]) -> List[Optional[str]]:
+        return [port for port, _ in self.lookup(bodies)]
+
+    def lookup(self, bodies: List[dict], fetch: bool = True) -> List[Tuple[Optional[str], bool]]:
+        """
+        Get the ports of the consignments from the cache or in a bounded pool of threads,
+        with the flag whether the microservice answered. Without fetch only the cache is used.
+        """
+        cached: dict = self.cache.get_many(bodies) if self.cache else {}
+        missing: list = [body for body in bodies if ConsignmentsCache.get_key(body) not in cached]
+        count("consignments_cache_hits", len(bodies) - len(missing))
+        logger.info(f"Ports in the cache {len(bodies) - len(missing)}, "
+                    f"{'requests to' if fetch else 'deferred'} the microservice {len(missing)}")
+        unanswered: set = set()
+        if missing and not fetch:
+            unanswered.update(map(ConsignmentsCache.get_key, missing))
+            cached.update((key, None) for key in unanswered)
+        elif missing:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as executor:
+                results: list = list(executor.map(self.fetch_port, missing))
+            if self.cache:
+                self.cache.set_many([(body, port) for body, (port, answered) in zip(missing, results) if answered])
+            unanswered.update(ConsignmentsCache.get_key(body) for body, (_, answered) in zip(missing, results)
+                              if not answered)
+            cached.update((ConsignmentsCache.get_key(body), port) for body, (port, _) in zip(missing, results))
+        return [(cached[key], key not in unanswered) for key in map(ConsignmentsCache.get_key, bodies)]
+
+
+_client: Optional[ConsignmentsClient] = None
+_deferred: Optional[DeferredLookups] = None
+
+
+def get_consignments_client() -> ConsignmentsClient:
+    """
+    Get the client shared by every file of the process.
+    """
+    global _client
+    if _client is None:
+        _client = ConsignmentsClient(cache=ConsignmentsCache() if CACHE_PATH else None)
+    return _client
+
+
+def get_deferred_lookups() -> Optional[DeferredLookups]:
+    """
+    Get the queue of the deferred lookups of the process, None if CONSIGNMENTS_DEFERRED_PATH is empty.
+    """
+    global _deferred
+    if _deferred is None and DEFERRED_PATH:
+        _deferred = DeferredLookups()
+    return _deferred
@@ -0,0 +1,347 @@
+import os
+import sys
+import time
+import fnmatch
+import atexit
+import sqlite3
+import threading
+import subprocess
+import multiprocessing
+from __init__ import logger
+from consignments import DEFERRED_PATH
+from enrichment import ENRICHMENT_SINK
+from ledger import Ledger, file_digest
+from watcher import InotifyWatcher, start_watcher
+from typing import Dict, List, Optional, Tuple
+from flat_export import Export
+from export_grain import ExportGrain
+from report_order import Report_Order
+from report_orders_update import Report_Order_Update
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+FILE_PATTERNS: tuple = ("*.xls*", "*.XLS*", "*.xml")
+
+SOURCE_NAMES: tuple = ("flat_export", "export_grain", "report_order", "report_orders_update")
+
+SCAN_INTERVAL: float = float(os.environ.get("DAEMON_SCAN_INTERVAL", 1))
+RESCAN_INTERVAL: float = float(os.environ.get("DAEMON_RESCAN_INTERVAL", 30))
+DEBOUNCE: float = float(os.environ.get("DAEMON_DEBOUNCE", 0.5))
+WORKERS: int = int(os.environ.get("DAEMON_WORKERS", os.cpu_count() or 1))
+ENRICHMENT: bool = os.environ.get("DAEMON_ENRICHMENT", "1") == "1"
+ENRICHMENT_RESTART_DELAY: float = float(os.environ.get("DAEMON_ENRICHMENT_RESTART_DELAY", 60))
+
+
+class Source(object):
+    def __init__(self, name: str, xls_path: str, parser: type, settle_seconds: int, priority: int = 0,
+                 after: tuple = (), serial: bool = False, debounce: float = DEBOUNCE):
+        self.name: str = name
+        self.xls_path: str = xls_path
+        self.parser: type = parser
+        self.settle_seconds: int = settle_seconds
+        self.debounce: float = debounce
+        self.priority: int = priority
+        self.after: tuple = after
+        self.serial: bool = serial
+        self.done_path: str = os.path.join(xls_path, "done")
+        self.json_path: str = os.path.join(xls_path, "json")
+
+    def prepare(self) -> None:
+        """
+        Create the done and json folders.
+        """
+        os.makedirs(self.done_path, exist_ok=True)
+        os.makedirs(self.json_path, exist_ok=True)
+
+    def find_files(self, closed: Dict[str, float]) -> Tuple[List[Tuple[float, str]], float]:
+        """
+        Find the complete files, the oldest first, and the time when the next incomplete file can be complete.
+        A file is complete debounce seconds after it was closed, if it was not changed since,
+        or when it was not changed during the last settle_seconds.
+        """
+        files: list = []
+        next_check: float = float("inf")
+        now: float = time.time()
+        with os.scandir(self.xls_path) as entries:
+            for entry in entries:
+                if not entry.is_file() or "error_" in entry.name:
+                    continue
+                if not any(fnmatch.fnmatchcase(entry.name, pattern) for pattern in FILE_PATTERNS):
+                    continue
+                mtime: float = entry.stat().st_mtime
+                complete_at: float = mtime + self.settle_seconds
+                closed_at: Optional[float] = closed.get(entry.path)
+                if closed_at is not None and mtime <= closed_at:
+                    complete_at = min(complete_at, closed_at + self.debounce)
+                if complete_at <= now:
+                    files.append((mtime, entry.path))
+                else:
+                    next_check = min(next_check, complete_at)
+        return sorted(files), next_check
+
+
+def get_sources(names: List[str]) -> List[Source]:
+    """
+    Build the watched directories the same way as the scripts in bash_dir.
+    Update directories are processed one file at a time and never before older files of their base directory.
+    """
+    root: str = os.environ["XL_IDP_PATH_EXPORT"]
+    sources: list = []
+    if "flat_export" in names:
+        terminal: str = os.environ["XL_IMPORT_TERMINAL"]
+        tracking: str = f"flat_export_{terminal}_tracking"
+        sources.append(Source(tracking, os.path.join(root, f"lines_{terminal}", tracking), Export, 3))
+        sources.append(Source(f"{tracking}_update", os.path.join(root, f"lines_{terminal}", f"{tracking}_update"),
+                              Export, 3, after=(tracking,), serial=True))
+    if "export_grain" in names:
+        sources.append(Source("export_grain", os.path.join(root, "export_grain", "flat_export_grain"), ExportGrain, 3))
+    if "report_order" in names:
+        xls_path = os.path.join(root, "report_orders", "flat_report_orders")
+        sources.append(Source("report_order", xls_path, Report_Order, 60, priority=1))
+    if "report_orders_update" in names:
+        xls_path = os.path.join(root, "report_orders", "flat_update_report_orders")
+        sources.append(Source("report_orders_update", xls_path, Report_Order_Update, 60, priority=1,
+                              after=("report_order",), serial=True))
+    return sources
+
+
+def move_to_error(source: Source, file_path: str) -> None:
+    """
+    Rename the file to error_, the file is left in place if it can not be renamed.
+    """
+    if not os.path.exists(file_path):
+        return
+    try:
+        os.replace(file_path, os.path.join(source.xls_path, f"error_{os.path.basename(file_path)}"))
+    except OSError as ex:
+        logger.error(f"The file {file_path} can not be renamed to error_ : {ex}")
+
+
+def open_ledger(source: Source, file_path: str) -> Tuple[Optional[Ledger], Optional[str], Optional[tuple]]:
+    """
+    Get the ledger, the digest of the file and the same file already processed by the parser.
+    When the ledger or the file can not be read, the file is processed as not seen before.
+    """
+    try:
+        ledger: Ledger = Ledger()
+        digest: str = file_digest(file_path)
+        return ledger, digest, ledger.find_done(digest, source.parser.__name__)
+    except (OSError, sqlite3.Error) as ex:
+        logger.error(f"The ledger is not available for the file {file_path} : {ex}")
+        return None, None, None
+
+
+def record(ledger: Optional[Ledger], method: str, *args) -> Optional[int]:
+    """
+    Write to the ledger, its errors are logged and do not fail the file.
+    """
+    if ledger is None:
+        return None
+    try:
+        return getattr(ledger, method)(*args)
+    except sqlite3.Error as ex:
+        logger.error(f"Error writing to the ledger : {ex}")
+        return None
+
+
+def process_file(source: Source, file_path: str) -> bool:
+    """
+    Parse the file and move it to done or rename it to error_.
+    A file with the same content as a file already processed by the parser is moved to done without parsing.
+    """
+    basename: str = os.path.basename(file_path)
+    ledger, digest, previous = open_ledger(source, file_path)
+    file_id: Optional[int] = None
+    start: float = time.time()
+    try:
+        size: int = os.path.getsize(file_path)
+        if previous is not None:
+            logger.info(f"The file {file_path} is the same as the file {previous[2]} in {previous[1]}, skipped")
+            record(ledger, "start", digest, size, source.parser.__name__, source.xls_path, basename, "duplicate")
+            os.replace(file_path, os.path.join(source.done_path, basename))
+            return True
+        logger.info(f"Processing the file {file_path} ({source.name})")
+        file_id = record(ledger, "start", digest, size, source.parser.__name__, source.xls_path, basename)
+        source.parser(file_path, source.json_path).main()
+        os.replace(file_path, os.path.join(source.done_path, basename))
+    except (Exception, SystemExit) as ex:
+        logger.exception(f"Error processing the file {file_path} : {ex}")
+        if file_id is not None:
+            record(ledger, "finish", file_id, "error")
+        move_to_error(source, file_path)
+        return False
+    if file_id is not None:
+        record(ledger, "finish", file_id, "done")
+    logger.info(f"The file {basename} is processed in {time.time() - start:.3f} seconds")
+    return True
+
+
+class Sidecar(object):
+    """
+    Runs a script of this directory in a child process next to the daemon and starts it again when it exits.
+    """
+
+    def __init__(self, script: str, restart_delay: float = ENRICHMENT_RESTART_DELAY):
+        self.script: str = script
+        self.restart_delay: float = restart_delay
+        self.process: Optional[subprocess.Popen] = None
+        self.thread: threading.Thread = threading.Thread(target=self.run, name=script, daemon=True)
+
+    def run(self) -> None:
+        while True:
+            self.process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__), self.script)])
+            return_code: int = self.process.wait()
+            logger.error(f"The process {self.script} exited with the code {return_code}, "
+                         f"it is started again in {self.restart_delay} seconds")
+            time.sleep(self.restart_delay)
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def start(self) -> None:
+        atexit.register(self.stop)
+        self.thread.start()
+
+
+def start_enrichment(sources: List[Source]) -> Optional[Sidecar]:
+    """
+    Start enrichment.py, which looks up the ports of the deferred rows and updates them in ClickHouse, when the
+    queue of the deferred lookups is configured and a watched directory looks up ports. DAEMON_ENRICHMENT=0
+    turns it off, when the worker runs elsewhere, and it is not started with the json sink, whose patches are
+    only to be checked. The worker is configured by the same environment as the parsers:
+    CONSIGNMENTS_DEFERRED_PATH, ENRICHMENT_SINK, ENRICHMENT_BATCH_SIZE, ENRICHMENT_DELAY, ENRICHMENT_INTERVAL,
+    ENRICHMENT_MAX_ATTEMPTS, HOST, DATABASE, USERNAME_DB, PASSWORD and CLICKHOUSE_TABLE_EXPORT.
+    """
+    if not ENRICHMENT or not DEFERRED_PATH or ENRICHMENT_SINK != "clickhouse":
+        return None
+    if not any(source.parser in (Export, Report_Order) for source in sources):
+        return None
+    sidecar: Sidecar = Sidecar("enrichment.py")
+    sidecar.start()
+    logger.info("Started the enrichment of the deferred lookups")
+    return sidecar
+
+
+class Daemon(object):
+    """
+    Runs the files of all the watched directories in a pool of processes.
+    Every round gives a free worker to each directory in turn, in the order of priority.
+    With inotify a round starts when a file is closed or a worker is free, else every scan_interval.
+    The enrichment of the deferred lookups runs next to the pool, see start_enrichment.
+    """
+
+    def __init__(self, sources: List[Source], workers: int = WORKERS, scan_interval: float = SCAN_INTERVAL):
+        self.sources: List[Source] = sorted(sources, key=lambda source: source.priority)
+        self.workers: int = workers
+        self.scan_interval: float = scan_interval
+        self.in_flight: Dict[str, Tuple[Source, float, Future]] = {}
+        self.closed: Dict[str, float] = {}
+        self.next_check: float = 0
+        self.wake: threading.Event = threading.Event()
+        self.watcher: Optional[InotifyWatcher] = None
+        self.enrichment: Optional[Sidecar] = None
+
+    def on_file(self, file_path: Optional[str]) -> None:
+        """
+        Remember when the file was closed and start a round.
+        """
+        if file_path is not None and "error_" not in os.path.basename(file_path):
+            self.closed[file_path] = time.time()
+        self.wake.set()
+
+    def get_timeout(self) -> float:
+        if self.watcher is None:
+            return self.scan_interval
+        return max(0.0, min(RESCAN_INTERVAL, self.next_check - time.time()))
+
+    def is_blocked(self, source: Source, mtime: float, pending: Dict[str, list]) -> bool:
+        """
+        Check whether the file has to wait for another file.
+        """
+        in_flight: list = [(flight_source, flight_mtime) for flight_source, flight_mtime, _ in self.in_flight.values()]
+        if source.serial and any(flight_source is source for flight_source, _ in in_flight):
+            return True
+        for name in source.after:
+            if any(flight_source.name == name and flight_mtime <= mtime for flight_source, flight_mtime in in_flight):
+                return True
+            if any(pending_mtime <= mtime for pending_mtime, _ in pending.get(name, [])):
+                return True
+        return False
+
+    def dispatch(self, executor: ProcessPoolExecutor) -> None:
+        """
+        Submit the files found in the watched directories to the free workers.
+        """
+        pending: Dict[str, list] = {}
+        self.next_check = float("inf")
+        for file_path in [file_path for file_path in list(self.closed) if not os.path.exists(file_path)]:
+            del self.closed[file_path]
+        for source in self.sources:
+            source.prepare()
+            files, next_check = source.find_files(self.closed)
+            pending[source.name] = [file for file in files if file[1] not in self.in_flight]
+            self.next_check = min(self.next_check, next_check)
+        submitted: bool = True
+        while submitted and len(self.in_flight) < self.workers:
+            submitted = False
+            for source in self.sources:
+                if len(self.in_flight) >= self.workers or not pending[source.name]:
+                    continue
+                mtime, file_path = pending[source.name][0]
+                if self.is_blocked(source, mtime, pending):
+                    continue
+                pending[source.name].pop(0)
+                self.closed.pop(file_path, None)
+                future: Future = executor.submit(process_file, source, file_path)
+                future.add_done_callback(lambda _: self.wake.set())
+                self.in_flight[file_path] = (source, mtime, future)
+                submitted = True
+
+    def collect(self) -> bool:
+        """
+        Forget the finished files, return False if the pool of processes is broken.
+        A file whose worker failed is renamed to error_, the daemon goes on with the next files.
+        """
+        is_alive: bool = True
+        for file_path, (source, _, future) in list(self.in_flight.items()):
+            if not future.done():
+                continue
+            del self.in_flight[file_path]
+            try:
+                future.result()
+            except BrokenProcessPool as ex:
+                logger.error(f"The worker processing the file {file_path} died : {ex}")
+                move_to_error(source, file_path)
+                is_alive = False
+            except Exception as ex:
+                logger.exception(f"Error processing the file {file_path} : {ex}")
+                move_to_error(source, file_path)
+        return is_alive
+
+    def run(self) -> None:
+        """
+        Watch the directories forever. The workers are spawned, not forked, as the threads of the watcher and of
+        the enrichment may hold a lock of the logger or of sqlite at the time of a fork.
+        """
+        for source in self.sources:
+            source.prepare()
+        self.watcher = start_watcher([source.xls_path for source in self.sources], self.on_file)
+        self.enrichment = start_enrichment(self.sources)
+        logger.info(f"Watching the directories: {', '.join(source.xls_path for source in self.sources)}")
+        context = multiprocessing.get_context("spawn")
+        while True:
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+                while True:
+                    self.wake.clear()
+                    if not self.collect():
+                        break
+                    self.dispatch(executor)
+                    self.wake.wait(self.get_timeout())
+            while self.in_flight:
+                self.collect()
+
+
+if __name__ == "__main__":
+    daemon: Daemon = Daemon(get_sources(sys.argv[1:] or list(SOURCE_NAMES)))
+    daemon.run()
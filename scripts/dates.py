@@ -0,0 +1,79 @@
+import os
+import re
+import contextlib
+import pandas as pd
+from pandas import Series
+from typing import Optional
+from datetime import date, datetime
+
+SAMPLE_SIZE: int = 200
+
+
+def convert_format_date(date: str, date_formats: tuple) -> Optional[str]:
+    """
+    Convert to a date type.
+    """
+    for date_format in date_formats:
+        with contextlib.suppress(ValueError):
+            return str(datetime.strptime(date, date_format).date())
+    return None
+
+
+def date_from_file_name(file_path: str) -> Optional[date]:
+    """
+    Get the month at the beginning of the name of the file, 2024.01 is 2024-01-01. None if there is no month.
+    """
+    month: Optional[re.Match] = re.match(r'\d{2,4}.\d{1,2}', os.path.basename(file_path))
+    if month is None:
+        return None
+    return datetime.strptime(f'{month.group()}.01', "%Y.%m.%d").date()
+
+
+def detect_formats(values: Series, date_formats: tuple) -> list:
+    """
+    Get the formats found in a sample of the values, the most frequent first.
+    """
+    counts: dict = {}
+    for value in values.drop_duplicates().head(SAMPLE_SIZE):
+        for date_format in date_formats:
+            with contextlib.suppress(ValueError):
+                datetime.strptime(value, date_format)
+                counts[date_format] = counts.get(date_format, 0) + 1
+                break
+    return sorted(counts, key=counts.get, reverse=True)
+
+
+def matches_format(value: str, date_format: str) -> bool:
+    """
+    Check that the whole value is in the format, pandas 1.x parses ISO formats without it.
+    """
+    try:
+        datetime.strptime(value, date_format)
+    except ValueError:
+        return False
+    return True
+
+
+def convert_column(column: Series, date_formats: tuple) -> Series:
+    """
+    Convert a column to dates in the format YYYY-MM-DD.
+    The whole column is parsed with the formats found in a sample, every distinct match is checked against its
+    format, the rest of the values are parsed one by one.
+    Empty values become None.
+    """
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column.dt.strftime("%Y-%m-%d").astype(object).where(column.notna(), None)
+    result: Series = Series([None] * len(column), index=column.index, dtype=object)
+    filled = column.notna() & column.astype(bool)
+    values: Series = column[filled].astype(str)
+    for date_format in detect_formats(values, date_formats):
+        parsed = pd.to_datetime(values, format=date_format, errors="coerce")
+        if not pd.api.types.is_datetime64_any_dtype(parsed):
+            continue
+        found = parsed.notna()
+        exact: set = {value for value in values[found].unique() if matches_format(value, date_format)}
+        found &= values.isin(exact)
+        result[found[found].index] = parsed[found].dt.strftime("%Y-%m-%d")
+        values = values[~found]
+    result[values.index] = values.map(lambda x: convert_format_date(x, date_formats))
+    return result
@@ -0,0 +1,162 @@
+"""
+Enrichment of the rows whose lookup of the port was deferred or not answered while the file was parsed.
+
+daemon.py starts it next to the parsers when CONSIGNMENTS_DEFERRED_PATH is set and the sink is clickhouse,
+it can also be run on its own, with --once to drain the queue and exit:
+
+    python3 scripts/enrichment.py --once
+
+A row leaves the queue only when its patch is applied to ClickHouse. The json sink writes the patches of one
+batch to ENRICHMENT_OUTPUT_PATH to check them and leaves the queue as it is.
+
+The environment:
+    CONSIGNMENTS_DEFERRED_PATH  the queue of the deferred lookups, shared with the parsers, a relative path is in
+                                XL_IDP_DATA_EXPORT, $XL_IDP_PATH_EXPORT/data by default
+    CONSIGNMENTS_DEFERRED_MAX_SIZE  rows kept in the queue, the oldest ones are dropped
+    ENRICHMENT_SINK             clickhouse mutations of CLICKHOUSE_TABLE_EXPORT, with HOST, DATABASE,
+                                USERNAME_DB and PASSWORD, or json patches in ENRICHMENT_OUTPUT_PATH
+    ENRICHMENT_BATCH_SIZE       rows looked up at once
+    ENRICHMENT_DELAY            seconds a row waits in the queue before it is looked up
+    ENRICHMENT_INTERVAL         seconds between the checks of an empty queue
+    ENRICHMENT_MAX_ATTEMPTS     lookups of a row before it is given up
+"""
+import os
+import sys
+import time
+import pandas as pd
+from __init__ import logger
+from typing import Dict, List
+from writers import JsonWriter
+from clickhouse import get_clickhouse
+from consignments import get_consignments_client, get_deferred_lookups
+
+ENRICHMENT_SINK: str = os.environ.get("ENRICHMENT_SINK", "clickhouse")
+ENRICHMENT_OUTPUT_PATH: str = os.environ.get("ENRICHMENT_OUTPUT_PATH", "enrichment")
+ENRICHMENT_BATCH_SIZE: int = int(os.environ.get("ENRICHMENT_BATCH_SIZE", 5000))
+ENRICHMENT_DELAY: float = float(os.environ.get("ENRICHMENT_DELAY", 600))
+ENRICHMENT_INTERVAL: float = float(os.environ.get("ENRICHMENT_INTERVAL", 60))
+ENRICHMENT_MAX_ATTEMPTS: int = int(os.environ.get("ENRICHMENT_MAX_ATTEMPTS", 20))
+CLICKHOUSE_TABLE: str = os.environ.get("CLICKHOUSE_TABLE_EXPORT", "export")
+MAX_QUERY_SIZE: int = 64 * 1024 * 1024
+
+
+def quote(value) -> str:
+    if value is None:
+        return "NULL"
+    value = str(value).replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{value}'"
+
+
+class EnrichmentWorker(object):
+    """
+    Looks up the ports of the deferred rows in batches and writes them as patches:
+    mutations of the table of ClickHouse, or json lines keyed by the file name and the consignment column.
+    The rows are taken ENRICHMENT_DELAY seconds after they were queued, so the parsed file is loaded by then,
+    the rows of the files that are not loaded yet are postponed.
+    """
+
+    def __init__(self, sink: str = ENRICHMENT_SINK, batch_size: int = ENRICHMENT_BATCH_SIZE,
+                 delay: float = ENRICHMENT_DELAY):
+        self.sink: str = sink
+        self.batch_size: int = batch_size
+        self.delay: float = delay
+        self.deferred = get_deferred_lookups()
+        self.client = get_consignments_client()
+        self.clickhouse = get_clickhouse() if sink == "clickhouse" else None
+
+    def run_batch(self) -> int:
+        """
+        Enrich a batch of rows, return the number of rows taken from the queue.
+        """
+        rows: List[tuple] = self.deferred.take(self.batch_size, self.delay, ENRICHMENT_MAX_ATTEMPTS)
+        if not rows:
+            return 0
+        bodies: Dict[str, dict] = {key: body for key, body, _, _, _ in rows}
+        results = dict(zip(bodies, self.client.lookup(list(bodies.values()))))
+        answered: list = [row for row in rows if results[row[0]][1]]
+        patches: list = [
+            {"original_file_name": file_name, "column": column, "value": value,
+             "tracking_seaport": results[key][0] or None, "is_auto_tracking": True,
+             "is_auto_tracking_ok": bool(results[key][0])}
+            for key, _, file_name, column, value in answered
+        ]
+        if self.sink != "clickhouse":
+            self.write_json(patches)
+            logger.info(f"Wrote the patches of {len(answered)} of {len(rows)} deferred rows, the queue is kept")
+            return len(rows)
+        applied: set = self.apply_patches(patches) if patches else set()
+        self.deferred.remove([row for row in rows if tuple(row[2:]) in applied])
+        self.deferred.postpone([row for row in rows if tuple(row[2:]) not in applied])
+        logger.info(f"Enriched {len(applied)} of {len(rows)} deferred rows")
+        return len(rows)
+
+    def apply_patches(self, patches: List[dict]) -> set:
+        """
+        Update the rows of the files loaded into ClickHouse, return the file name, the column and the value
+        of the applied patches.
+        """
+        applied: set = set()
+        df: pd.DataFrame = pd.DataFrame(patches)
+        for (file_name, column), group in df.groupby(["original_file_name", "column"]):
+            loaded: set = self.find_loaded(file_name, column, group["value"].tolist())
+            found: list = [patch for patch in group.to_dict("records") if patch["value"] in loaded]
+            if found:
+                self.update_table(file_name, column, found)
+                applied.update((file_name, column, patch["value"]) for patch in found)
+        return applied
+
+    def find_loaded(self, file_name: str, column: str, values: list) -> set:
+        """
+        Get the values of the consignment column of the file that are in the table.
+        """
+        rows = self.clickhouse.query(
+            f"SELECT DISTINCT {column} FROM {CLICKHOUSE_TABLE} WHERE original_file_name = {quote(file_name)} "
+            f"AND {column} IN ({', '.join(quote(value) for value in values)})",
+            settings={"max_query_size": MAX_QUERY_SIZE}
+        ).result_rows
+        return {str(row[0]) for row in rows}
+
+    def write_json(self, patches: List[dict]) -> None:
+        os.makedirs(ENRICHMENT_OUTPUT_PATH, exist_ok=True)
+        output_file_path: str = os.path.join(ENRICHMENT_OUTPUT_PATH, f"patches_{time.time_ns()}.ndjson")
+        with JsonWriter(output_file_path, "ndjson") as writer:
+            writer.write(pd.DataFrame(patches))
+
+    def update_table(self, file_name: str, column: str, patches: List[dict]) -> None:
+        """
+        Update the rows of the file with one mutation, the values are picked by the consignment column.
+        """
+        values: list = [quote(patch["value"]) for patch in patches]
+        seaports: str = ", ".join(
+            f"{column} = {value}, {quote(patch['tracking_seaport'])}" for value, patch in zip(values, patches)
+        )
+        oks: str = ", ".join(
+            f"{column} = {value}, {str(patch['is_auto_tracking_ok']).lower()}" for value, patch in zip(values, patches)
+        )
+        query = f"""
+        ALTER TABLE {CLICKHOUSE_TABLE} UPDATE
+        tracking_seaport = multiIf({seaports}, tracking_seaport),
+        is_auto_tracking = true,
+        is_auto_tracking_ok = multiIf({oks}, is_auto_tracking_ok)
+        WHERE original_file_name = {quote(file_name)} AND {column} IN ({", ".join(values)})
+        """
+        self.clickhouse.command(query, settings={"max_query_size": MAX_QUERY_SIZE})
+
+    def run(self, once: bool = False) -> None:
+        """
+        Drain the queue, then wait for new rows unless once. The json sink writes one batch.
+        """
+        while True:
+            while self.run_batch() == self.batch_size and self.sink == "clickhouse":
+                pass
+            if once or self.sink != "clickhouse":
+                return
+            time.sleep(ENRICHMENT_INTERVAL)
+
+
+if __name__ == "__main__":
+    worker: EnrichmentWorker = EnrichmentWorker()
+    if worker.deferred is None:
+        logger.error("CONSIGNMENTS_DEFERRED_PATH is empty, there is nothing to enrich")
+        sys.exit(1)
+    worker.run(once="--once" in sys.argv[1:])
@@ -1,13 +1,16 @@
 import os
 import sys
-import json
-import itertools
-import contextlib
-import numpy as np
 import pandas as pd
-from typing import Optional
+from typing import Iterable, Iterator
 from pandas import DataFrame
+from writers import get_writer
+from dates import convert_column
+from readers import read_excel_chunks
+from metrics import measured, stage, timed
+from schema import HeaderMapper
+from cleaning import apply_dtypes, strip_strings
 from datetime import datetime
+from workbook_cache import cached_chunks
 
 HEADERS_ENG: dict = {
     ("Дата (без времени)", "Дата"): "date",
@@ -28,35 +31,43 @@ HEADERS_ENG: dict = {
 }
 
 
+HEADER_MAPPER: HeaderMapper = HeaderMapper(HEADERS_ENG)
+
+DTYPES: dict = {
+    "date": "date",
+    "customer": "category",
+    "goods_name": "category",
+    "transport_type": "category",
+    "terminal_and_location": "category",
+    "terminal_name": "category",
+    "terminal_address": "category",
+    "shipper_country": "category",
+    "consignee_country": "category",
+    "month": "Int64",
+    "year": "Int64",
+    "original_file_name": "category",
+    "original_file_parsed_on": "category"
+}
+
 DATE_FORMATS: tuple = ("%Y-%m-%d %H:%M:%S", "%d.%m.%Y", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M")
 
+CLICKHOUSE_TABLE: str = os.environ.get("CLICKHOUSE_TABLE_EXPORT_GRAIN", "export_grain")
+
+PARSER_VERSION: int = 1
+
 
 class ExportGrain(object):
     def __init__(self, input_file_path: str, output_folder: str):
         self.input_file_path: str = input_file_path
         self.output_folder: str = output_folder
-
-    @staticmethod
-    def convert_format_date(date: str) -> Optional[str]:
-        """
-        Convert to a date type.
-        """
-        for date_format in DATE_FORMATS:
-            with contextlib.suppress(ValueError):
-                return str(datetime.strptime(date, date_format).date())
+        self.original_file_parsed_on: str = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
     @staticmethod
     def rename_columns(df: DataFrame) -> None:
         """
         Rename of a columns.
         """
-        dict_columns_eng: dict = {}
-        for column, columns in itertools.product(df.columns, HEADERS_ENG):
-            for column_eng in columns:
-                column_strip: str = column.strip()
-                if column_strip == column_eng.strip():
-                    dict_columns_eng[column] = HEADERS_ENG[columns]
-        df.rename(columns=dict_columns_eng, inplace=True)
+        HEADER_MAPPER.rename(df)
 
     def add_new_columns(self, df: DataFrame) -> None:
         """
@@ -65,29 +76,55 @@ class ExportGrain(object):
         df['month'] = pd.to_datetime(df['date']).dt.month
         df['year'] = pd.to_datetime(df['date']).dt.year
         df['original_file_name'] = os.path.basename(self.input_file_path)
-        df['original_file_parsed_on'] = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        df['original_file_parsed_on'] = self.original_file_parsed_on
 
-    def write_to_json(self, parsed_data: list) -> None:
+    def write_to_json(self, chunks: Iterable[DataFrame]) -> None:
         """
         Write data to json.
         """
         basename: str = os.path.basename(self.input_file_path)
         output_file_path: str = os.path.join(self.output_folder, f'{basename}.json')
-        with open(f"{output_file_path}", 'w', encoding='utf-8') as f:
-            json.dump(parsed_data, f, ensure_ascii=False, indent=4)
+        with get_writer(output_file_path, CLICKHOUSE_TABLE) as writer:
+            for df in chunks:
+                with stage("write", df):
+                    writer.write(df)
 
-    def main(self) -> None:
+    def clean(self, df: DataFrame) -> DataFrame:
         """
-        The main function where we read the Excel file and write the file to json.
+        Clean a chunk of rows of the Excel file, the result is kept in the workbook cache.
         """
-        df: DataFrame = pd.read_excel(self.input_file_path)
         df = df.dropna(axis=0, how='all')
         self.rename_columns(df)
-        df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-        df["date"] = df["date"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
+        with stage("strip"):
+            df = strip_strings(df)
+        with stage("dates"):
+            df["date"] = convert_column(df["date"], DATE_FORMATS)
+        with stage("dtypes"):
+            df = apply_dtypes(df, DTYPES)
+        return df
+
+    def read(self) -> Iterator[DataFrame]:
+        """
+        Read the Excel file in cleaned chunks of rows.
+        """
+        chunks: Iterable[DataFrame] = timed(read_excel_chunks(self.input_file_path, header_mapper=HEADER_MAPPER))
+        return (self.clean(df) for df in chunks)
+
+    def transform(self, df: DataFrame) -> DataFrame:
+        """
+        Transform a cleaned chunk of rows of the Excel file.
+        """
         self.add_new_columns(df)
-        df = df.replace({np.nan: None, "NaT": None})
-        self.write_to_json(df.to_dict('records'))
+        return apply_dtypes(df, DTYPES)
+
+    @measured
+    def main(self) -> None:
+        """
+        The main function where we read the Excel file and write the file to json.
+        """
+        chunks: Iterable[DataFrame] = cached_chunks(self.input_file_path, type(self).__name__, PARSER_VERSION,
+                                                    self.read)
+        self.write_to_json(self.transform(df) for df in chunks)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+import os
+import re
+import sqlite3
+import pandas as pd
+from pandas import DataFrame
+from __init__ import get_data_path, logger
+from cleaning import normalize_nulls
+
+FINGERPRINTS_PATH: str = get_data_path(os.environ.get("FINGERPRINTS_PATH", "fingerprints.sqlite3"))
+VOLATILE_COLUMNS: tuple = ("original_file_name", "original_file_parsed_on")
+CONSIGNMENT_COLUMNS: tuple = ("consignment", "booking", "container_number")
+BATCH: int = 500
+
+
+def get_lineage(file_path: str) -> str:
+    """
+    Get the name shared by the re-uploads of a file: without the extension and the copy suffixes.
+    """
+    name: str = os.path.splitext(os.path.basename(file_path))[0]
+    return re.sub(r"(\s*\(\d+\)|[\s_-]*(copy|копия|v\d+))+$", "", name, flags=re.IGNORECASE).strip()
+
+
+class RowFingerprints(object):
+    """
+    Hashes of the rows of the files already processed, by lineage of the file and consignment.
+    Rows with a known hash are skipped, the hashes of a consignment are replaced by the ones of the last upload.
+    """
+
+    def __init__(self, file_path: str, path: str = FINGERPRINTS_PATH):
+        self.lineage: str = get_lineage(file_path)
+        self.pending: dict = {}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection: sqlite3.Connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints "
+                "(lineage TEXT, consignment TEXT, hash TEXT, PRIMARY KEY (lineage, consignment, hash))"
+            )
+
+    @staticmethod
+    def get_consignments(df: DataFrame) -> pd.Series:
+        for column in CONSIGNMENT_COLUMNS:
+            if column in df.columns:
+                return df[column].astype(str)
+        return pd.Series("", index=df.index)
+
+    def get_known(self, consignments: list) -> set:
+        known: set = set()
+        for i in range(0, len(consignments), BATCH):
+            batch: list = consignments[i:i + BATCH]
+            known.update(self.connection.execute(
+                f"SELECT consignment, hash FROM fingerprints "
+                f"WHERE lineage = ? AND consignment IN ({','.join('?' * len(batch))})", [self.lineage, *batch]
+            ).fetchall())
+        return known
+
+    def filter_changed(self, df: DataFrame) -> DataFrame:
+        """
+        Keep the new and changed rows.
+        """
+        columns: list = sorted(column for column in df.columns if column not in VOLATILE_COLUMNS)
+        hashes: pd.Series = pd.util.hash_pandas_object(normalize_nulls(df[columns].copy()).astype(str), index=False).astype(str)
+        consignments: pd.Series = self.get_consignments(df)
+        for consignment, row_hash in zip(consignments, hashes):
+            self.pending.setdefault(consignment, set()).add(row_hash)
+        known: set = self.get_known(list(consignments.unique()))
+        changed = [(consignment, row_hash) not in known for consignment, row_hash in zip(consignments, hashes)]
+        logger.info(f"Changed rows {sum(changed)} of {len(df)} in {self.lineage}")
+        return df[changed].copy()
+
+    def commit(self) -> None:
+        """
+        Save the hashes of the processed rows.
+        """
+        with self.connection:
+            for consignment, hashes in self.pending.items():
+                self.connection.execute(
+                    "DELETE FROM fingerprints WHERE lineage = ? AND consignment = ?", (self.lineage, consignment)
+                )
+                self.connection.executemany(
+                    "INSERT INTO fingerprints VALUES (?, ?, ?)",
+                    [(self.lineage, consignment, row_hash) for row_hash in hashes]
+                )
+        self.pending = {}
@@ -1,16 +1,19 @@
-import re
 import os
 import sys
-import json
 import requests
 import contextlib
-import numpy as np
-import pandas as pd
-from typing import Optional
 from parsed import ParsedDf
+from dates import convert_column, date_from_file_name
+from readers import read_excel_chunks
+from metrics import measured, stage, timed
+from schema import HeaderMapper
+from cleaning import apply_dtypes, strip_strings
+from fingerprints import RowFingerprints
+from workbook_cache import cached_chunks
+from typing import Iterable, Iterator, Optional
 from pandas import DataFrame
-from datetime import datetime
-from notifiers import get_notifier
+from writers import get_writer
+from datetime import date, datetime
 
 CHAT_ID = '-1002064780308'
 TOPIC = '1069'
@@ -46,8 +49,37 @@ dict_types: dict = {
     "ТНВЭД": str
 }
 
+HEADER_MAPPER: HeaderMapper = HeaderMapper(headers_eng)
+
+DTYPES: dict = {
+    "terminal": "category",
+    "line": "category",
+    "shipment_date": "date",
+    "container_count": "Int64",
+    "container_size": "Int64",
+    "teu": "Int64",
+    "container_type": "category",
+    "tracking_seaport": "category",
+    "tracking_country": "category",
+    "ship_name": "category",
+    "voyage": "category",
+    "expeditor": "category",
+    "gtd_number": "category",
+    "parsed_on": "date",
+    "original_file_name": "category",
+    "original_file_parsed_on": "category",
+    "is_auto_tracking": "boolean",
+    "is_auto_tracking_ok": "boolean"
+}
+
 date_formats: tuple = ("%Y-%m-%d", "%d.%m.%Y", "%Y-%m-%d %H:%M:%S")
 
+CLICKHOUSE_TABLE: str = os.environ.get("CLICKHOUSE_TABLE_EXPORT", "export")
+
+INCREMENTAL_SUFFIX: str = "_tracking_update"
+
+PARSER_VERSION: int = 1
+
 
 
 def telegram(message):
@@ -67,23 +99,17 @@ class Export(object):
     def __init__(self, input_file_path: str, output_folder: str):
         self.input_file_path: str = input_file_path
         self.output_folder: str = output_folder
-
-    @staticmethod
-    def convert_format_date(date: str) -> Optional[str]:
-        """
-        Convert to a date type.
-        """
-        for date_format in date_formats:
-            with contextlib.suppress(ValueError):
-                return str(datetime.strptime(date, date_format).date())
-        return None
+        self.original_file_parsed_on: str = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        self.fingerprints: Optional[RowFingerprints] = None
+        if os.path.dirname(os.path.abspath(input_file_path)).endswith(INCREMENTAL_SUFFIX):
+            self.fingerprints = RowFingerprints(input_file_path)
 
     def change_type_and_values(self, df: DataFrame) -> None:
         """
         Change data types or changing values.
         """
         with contextlib.suppress(Exception):
-            df['shipment_date'] = df['shipment_date'].apply(lambda x: self.convert_format_date(str(x)))
+            df['shipment_date'] = convert_column(df['shipment_date'], date_formats)
 
     def add_new_columns(self, df: DataFrame, parsed_on: str) -> None:
         """
@@ -92,45 +118,77 @@ class Export(object):
         df['gtd_number'] = 'Нет данных'
         df['parsed_on'] = parsed_on
         df['original_file_name'] = os.path.basename(self.input_file_path)
-        df['original_file_parsed_on'] = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        df['original_file_parsed_on'] = self.original_file_parsed_on
 
     def check_date_in_begin_file(self) -> str:
         """
         Check the date at the beginning of the file.
         """
-        date_previous: re.Match = re.match(r'\d{2,4}.\d{1,2}', os.path.basename(self.input_file_path))
-        date_previous: str = f'{date_previous.group()}.01' if date_previous else date_previous
+        date_previous: Optional[date] = date_from_file_name(self.input_file_path)
         if date_previous is None:
             telegram(f'Не указана дата в файле {self.input_file_path}')
             raise AssertionError('Date not in file name!')
-        else:
-            return str(datetime.strptime(date_previous, "%Y.%m.%d").date())
+        return str(date_previous)
 
-    def write_to_json(self, parsed_data: list) -> None:
+    def write_to_json(self, chunks: Iterable[DataFrame]) -> None:
         """
         Write data to json.
         """
         basename: str = os.path.basename(self.input_file_path)
         output_file_path: str = os.path.join(self.output_folder, f'{basename}.json')
-        with open(f"{output_file_path}", 'w', encoding='utf-8') as f:
-            json.dump(parsed_data, f, ensure_ascii=False, indent=4)
+        with get_writer(output_file_path, CLICKHOUSE_TABLE) as writer:
+            for df in chunks:
+                with stage("write", df):
+                    writer.write(df)
 
+    def clean(self, df: DataFrame) -> DataFrame:
+        """
+        Clean a chunk of rows of the Excel file, the result is kept in the workbook cache.
+        """
+        df = df.dropna(axis=0, how='all')
+        HEADER_MAPPER.rename(df)
+        with stage("strip"):
+            df = strip_strings(df)
+        with stage("dates"):
+            self.change_type_and_values(df)
+        with stage("dtypes"):
+            df = apply_dtypes(df, DTYPES)
+        return df
+
+    def read(self) -> Iterator[DataFrame]:
+        """
+        Read the Excel file in cleaned chunks of rows.
+        """
+        chunks: Iterable[DataFrame] = timed(read_excel_chunks(self.input_file_path, dtype=dict_types,
+                                                              header_mapper=HEADER_MAPPER))
+        return (self.clean(df) for df in chunks)
+
+    def transform(self, df: DataFrame, parsed_on: str) -> DataFrame:
+        """
+        Transform a cleaned chunk of rows of the Excel file.
+        """
+        self.add_new_columns(df, parsed_on)
+        df = apply_dtypes(df, DTYPES)
+        if self.fingerprints is not None:
+            with stage("fingerprints"):
+                df = self.fingerprints.filter_changed(df)
+        with stage("get_port", df):
+            ParsedDf(df).get_port()
+        return apply_dtypes(df, DTYPES)
+
+    @measured
     def main(self) -> None:
         """
         The main function where we read the Excel file and write the file to json.
         """
-        df: DataFrame = pd.read_excel(self.input_file_path, dtype=dict_types)
-        df = df.dropna(axis=0, how='all')
-        df = df.rename(columns=headers_eng)
-        df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
         parsed_on: str = self.check_date_in_begin_file()
-        self.add_new_columns(df, parsed_on)
-        self.change_type_and_values(df)
-        df = df.replace({np.nan: None, "NaT": None})
-        ParsedDf(df).get_port()
-        df = df.replace({np.nan: None, "NaT": None})
-        self.write_to_json(df.to_dict('records'))
+        chunks: Iterable[DataFrame] = cached_chunks(self.input_file_path, type(self).__name__, PARSER_VERSION,
+                                                    self.read)
+        self.write_to_json(self.transform(df, parsed_on) for df in chunks)
+        if self.fingerprints is not None:
+            self.fingerprints.commit()
 
 
-export: Export = Export(sys.argv[1], sys.argv[2])
-export.main()
+if __name__ == "__main__":
+    export: Export = Export(sys.argv[1], sys.argv[2])
+    export.main()
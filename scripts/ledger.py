@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+from __init__ import get_data_path
+from typing import List, Optional
+
+LEDGER_PATH: str = get_data_path(os.environ.get("LEDGER_PATH", "ledger.sqlite3"))
+BLOCK_SIZE: int = 1024 * 1024
+
+
+def file_digest(file_path: str) -> str:
+    """
+    Get the sha256 of the content of the file.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Ledger(object):
+    """
+    Journal of the processed files: content hash, size, parser, status and timing.
+    It is kept in the data directory, so the files already processed are known after a restart.
+    """
+
+    def __init__(self, path: str = LEDGER_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection: sqlite3.Connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, digest TEXT, size INTEGER, parser TEXT, "
+                "directory TEXT, file_name TEXT, status TEXT, started_at REAL, finished_at REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_digest ON files (digest, parser, status)")
+
+    def find_done(self, digest: str, parser: str) -> Optional[tuple]:
+        """
+        Find a file with the same content that was already processed by the parser.
+        """
+        return self.connection.execute(
+            "SELECT id, directory, file_name, finished_at FROM files "
+            "WHERE digest = ? AND parser = ? AND status = 'done' ORDER BY id DESC LIMIT 1", (digest, parser)
+        ).fetchone()
+
+    def start(self, digest: str, size: int, parser: str, directory: str, file_name: str,
+              status: str = "processing") -> int:
+        now: float = time.time()
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO files (digest, size, parser, directory, file_name, status, started_at, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, size, parser, directory, file_name, status, now, None if status == "processing" else now)
+            )
+        return cursor.lastrowid
+
+    def finish(self, file_id: int, status: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "UPDATE files SET status = ?, finished_at = ? WHERE id = ?", (status, time.time(), file_id)
+            )
+
+    def stats(self, since: float = 0) -> List[tuple]:
+        """
+        Get the number of files, megabytes and seconds of processing by directory and status.
+        """
+        return self.connection.execute(
+            "SELECT directory, status, count(*), round(sum(size) / 1048576.0, 1), "
+            "round(avg(finished_at - started_at), 3), round(sum(finished_at - started_at), 1) "
+            "FROM files WHERE started_at >= ? GROUP BY directory, status ORDER BY directory, status", (since,)
+        ).fetchall()
+
+
+if __name__ == "__main__":
+    days: float = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    print("directory\tstatus\tfiles\tmegabytes\tavg_seconds\ttotal_seconds")
+    for row in Ledger().stats(time.time() - days * 24 * 60 * 60):
+        print("\t".join(str(value) for value in row))
@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import time
+import resource
+import functools
+import threading
+import contextlib
+from __init__ import logger
+from pandas import DataFrame
+from typing import Dict, Iterable, Iterator, Optional
+
+METRICS_LOG_PATH: str = os.environ.get("METRICS_LOG_PATH", f"metrics_{time.strftime('%Y-%m-%d')}.log")
+METRICS_TEXTFILE_DIR: str = os.environ.get("METRICS_TEXTFILE_DIR", "")
+PREFIX: str = "export_scripts"
+
+if METRICS_LOG_PATH:
+    logger.add(METRICS_LOG_PATH, format="{message}", filter=lambda record: "metrics" in record["extra"],
+               rotation="15 MB")
+
+
+_process_peak_rss: int = 0
+
+
+def get_process_peak_rss() -> int:
+    """
+    Get the peak of the resident memory since the start of the process, in bytes, the resets included.
+    """
+    return max(_process_peak_rss, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak of the resident memory of the process, so the peak of every file is measured on its own.
+    False if the system does not allow it.
+    """
+    global _process_peak_rss
+    _process_peak_rss = get_process_peak_rss()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def get_peak_rss() -> Optional[int]:
+    """
+    Get the peak of the resident memory since the last reset, in bytes.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            peak: Optional[re.Match] = re.search(r"^VmHWM:\s+(\d+) kB", f.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return int(peak.group(1)) * 1024 if peak else None
+
+
+class FileMetrics(object):
+    """
+    Timings of the stages, rows and events of the processing of a file.
+    The times and rows of a stage are summed over the chunks of the file.
+    peak_rss_bytes is the peak of the memory during the file, None where it can not be reset between the files,
+    process_peak_rss_bytes is the peak since the start of the process.
+    """
+
+    def __init__(self, parser: str, file_path: str):
+        self.parser: str = parser
+        self.file_name: str = os.path.basename(file_path)
+        self.started_at: float = time.time()
+        self.start: float = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.rows: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.is_peak_reset: bool = reset_peak_rss()
+
+    def add_stage(self, name: str, seconds: float, rows: Optional[int] = None) -> None:
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+            if rows is not None:
+                self.rows[name] = self.rows.get(name, 0) + rows
+
+    def add_counter(self, name: str, value: int) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self, status: str) -> dict:
+        return {
+            "parser": self.parser,
+            "file_name": self.file_name,
+            "status": status,
+            "started_at": self.started_at,
+            "seconds": round(time.perf_counter() - self.start, 3),
+            "peak_rss_bytes": get_peak_rss() if self.is_peak_reset else None,
+            "process_peak_rss_bytes": get_process_peak_rss(),
+            "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            "rows": dict(self.rows),
+            "counters": dict(self.counters)
+        }
+
+
+_current: Optional[FileMetrics] = None
+last_record: Optional[dict] = None
+
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Count an event of the file being processed, e.g. a request to the microservice.
+    """
+    if _current is not None:
+        _current.add_counter(name, value)
+
+
+@contextlib.contextmanager
+def stage(name: str, df: Optional[DataFrame] = None):
+    """
+    Log the time of a stage of the parsing and add it to the metrics of the file.
+    """
+    start: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds: float = time.perf_counter() - start
+        if _current is not None:
+            _current.add_stage(name, seconds, None if df is None else len(df))
+        logger.info(f"Stage {name} took {seconds:.3f} seconds")
+
+
+def timed(chunks: Iterable[DataFrame], name: str = "read") -> Iterator[DataFrame]:
+    """
+    Time the reading of the chunks of a file and count their rows.
+    """
+    iterator: Iterator[DataFrame] = iter(chunks)
+    while True:
+        start: float = time.perf_counter()
+        try:
+            df: DataFrame = next(iterator)
+        except StopIteration:
+            return
+        if _current is not None:
+            _current.add_stage(name, time.perf_counter() - start, len(df))
+        yield df
+
+
+def get_labels(**labels) -> str:
+    values: str = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return f"{{{values}}}"
+
+
+def write_textfile(record: dict) -> None:
+    """
+    Write the metrics of the last file of the parser for the textfile collector of node_exporter.
+    """
+    parser: str = record["parser"]
+    lines: list = [
+        f"# TYPE {PREFIX}_file_seconds gauge",
+        f"{PREFIX}_file_seconds{get_labels(parser=parser)} {record['seconds']}",
+        f"# TYPE {PREFIX}_file_success gauge",
+        f"{PREFIX}_file_success{get_labels(parser=parser)} {int(record['status'] == 'done')}",
+        f"# TYPE {PREFIX}_file_timestamp_seconds gauge",
+        f"{PREFIX}_file_timestamp_seconds{get_labels(parser=parser)} {record['started_at']:.0f}",
+        f"# TYPE {PREFIX}_process_peak_rss_bytes gauge",
+        f"{PREFIX}_process_peak_rss_bytes{get_labels(parser=parser)} {record['process_peak_rss_bytes']}"
+    ]
+    if record["peak_rss_bytes"] is not None:
+        lines.append(f"# TYPE {PREFIX}_peak_rss_bytes gauge")
+        lines.append(f"{PREFIX}_peak_rss_bytes{get_labels(parser=parser)} {record['peak_rss_bytes']}")
+    lines.append(f"# TYPE {PREFIX}_stage_seconds gauge")
+    lines.extend(f"{PREFIX}_stage_seconds{get_labels(parser=parser, stage=name)} {seconds}"
+                 for name, seconds in record["stages"].items())
+    lines.append(f"# TYPE {PREFIX}_stage_rows gauge")
+    lines.extend(f"{PREFIX}_stage_rows{get_labels(parser=parser, stage=name)} {rows}"
+                 for name, rows in record["rows"].items())
+    lines.append(f"# TYPE {PREFIX}_events gauge")
+    lines.extend(f"{PREFIX}_events{get_labels(parser=parser, event=name)} {value}"
+                 for name, value in record["counters"].items())
+    file_path: str = os.path.join(METRICS_TEXTFILE_DIR, f"{PREFIX}_{parser.lower()}.prom")
+    tmp_file_path: str = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_file_path, "w") as f:
+        f.write("\n".join(lines))
+        f.write("\n")
+    os.replace(tmp_file_path, file_path)
+
+
+def measured(main):
+    """
+    Collect the metrics of the file processed by the main method of a parser.
+    """
+    @functools.wraps(main)
+    def wrapper(self, *args, **kwargs):
+        global _current, last_record
+        _current = FileMetrics(type(self).__name__, self.input_file_path)
+        status: str = "error"
+        try:
+            result = main(self, *args, **kwargs)
+            status = "done"
+            return result
+        finally:
+            record: dict = _current.to_dict(status)
+            _current, last_record = None, record
+            logger.bind(metrics=True).info(json.dumps(record, ensure_ascii=False))
+            if METRICS_TEXTFILE_DIR:
+                try:
+                    write_textfile(record)
+                except OSError as ex:
+                    logger.error(f"Error writing the metrics to {METRICS_TEXTFILE_DIR} : {ex}")
+    return wrapper
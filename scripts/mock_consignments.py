@@ -0,0 +1,234 @@
+"""
+Local stand-in of the consignments microservice with injected latency and failures, and a load test of the lookup
+of the ports by ParsedDf against it.
+
+    python3 scripts/mock_consignments.py serve --port 8010 --latency lognormal:80:0.6 --error-rate 0.02
+    python3 scripts/mock_consignments.py load --rows 100000 --latency lognormal:80:0.6 --rate-limit 200 --workers 16
+"""
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from typing import List, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_DISTRIBUTIONS: tuple = ("fixed", "uniform", "exponential", "lognormal")
+LINES: tuple = ("MSC", "ARKAS", "SINOKOR", "HEUNG-A LINE", "REEL SHIPPING", "MAERSK", "COSCO")
+
+
+class MockSettings(object):
+    """
+    Behaviour of the mock: the latency is <distribution>:<milliseconds>[:<parameter>], e.g. fixed:20,
+    uniform:10:200 (from 10 to 200 ms), exponential:50 (mean 50 ms) or lognormal:50:0.5 (median 50 ms, sigma 0.5).
+    """
+
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0, timeout_rate: float = 0,
+                 hang_seconds: float = 30, not_found_rate: float = 0.1, rate_limit: float = 0):
+        distribution, *parameters = latency.split(":")
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {distribution}")
+        self.distribution: str = distribution
+        self.parameters: List[float] = [float(parameter) for parameter in parameters] or [0.0]
+        self.error_rate: float = error_rate
+        self.timeout_rate: float = timeout_rate
+        self.hang_seconds: float = hang_seconds
+        self.not_found_rate: float = not_found_rate
+        self.rate_limit: float = rate_limit
+
+    def get_latency(self) -> float:
+        """
+        Get a latency in seconds.
+        """
+        milliseconds: float = self.parameters[0]
+        if self.distribution == "uniform":
+            milliseconds = random.uniform(milliseconds, self.parameters[-1])
+        elif self.distribution == "exponential":
+            milliseconds = random.expovariate(1 / milliseconds) if milliseconds else 0
+        elif self.distribution == "lognormal":
+            sigma: float = self.parameters[1] if len(self.parameters) > 1 else 0.5
+            milliseconds = milliseconds * random.lognormvariate(0, sigma)
+        return milliseconds / 1000
+
+
+class RateLimiter(object):
+    """
+    Token bucket of requests per second, a burst of a second of requests is allowed.
+    """
+
+    def __init__(self, rate: float):
+        self.rate: float = rate
+        self.tokens: float = rate
+        self.updated_at: float = time.monotonic()
+        self.lock: threading.Lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self.lock:
+            now: float = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class MockConsignmentsServer(ThreadingHTTPServer):
+    daemon_threads: bool = True
+
+    def __init__(self, address: tuple, settings: MockSettings):
+        super().__init__(address, MockConsignmentsHandler)
+        self.settings: MockSettings = settings
+        self.rate_limiter: Optional[RateLimiter] = RateLimiter(settings.rate_limit) if settings.rate_limit else None
+        self.lock: threading.Lock = threading.Lock()
+        self.counters: dict = {"requests": 0, "ok": 0, "not_found": 0, "errors": 0, "timeouts": 0, "rate_limited": 0}
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] += 1
+
+
+class MockConsignmentsHandler(BaseHTTPRequestHandler):
+    """
+    Answers the body {"line", "consignment", "direction"} of ParsedDf with the port as a json string or null.
+    """
+
+    def do_POST(self) -> None:
+        server: MockConsignmentsServer = self.server
+        settings: MockSettings = server.settings
+        body: dict = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.count("requests")
+        if server.rate_limiter is not None and not server.rate_limiter.acquire():
+            server.count("rate_limited")
+            return self.answer(429, {"detail": "Too Many Requests"})
+        time.sleep(settings.get_latency())
+        draw: float = random.random()
+        if draw < settings.timeout_rate:
+            server.count("timeouts")
+            time.sleep(settings.hang_seconds)
+            self.close_connection = True
+            return
+        if draw < settings.timeout_rate + settings.error_rate:
+            server.count("errors")
+            return self.answer(500, {"detail": "Internal Server Error"})
+        if random.random() < settings.not_found_rate:
+            server.count("not_found")
+            return self.answer(200, None)
+        server.count("ok")
+        self.answer(200, f"PORT {body['line']} {body['direction']}".upper())
+
+    def answer(self, status: int, value) -> None:
+        answer: bytes = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_server(settings: Optional[MockSettings] = None, host: str = "127.0.0.1",
+                 port: int = 0) -> MockConsignmentsServer:
+    """
+    Start the mock in a thread and point IP_ADDRESS_CONSIGNMENTS and PORT to it.
+    """
+    server: MockConsignmentsServer = MockConsignmentsServer((host, port), settings or MockSettings())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["IP_ADDRESS_CONSIGNMENTS"] = host
+    os.environ["PORT"] = str(server.server_port)
+    return server
+
+
+def get_percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def load_test(server: MockConsignmentsServer, rows: int, unique: float, workers: int, attempts: int,
+              backoff: float, timeout: float) -> dict:
+    """
+    Run the lookup of the ports of a DataFrame like the ones of flat_export and measure it.
+    """
+    import pandas as pd
+    import clickhouse_connect
+    from benchmark import FakeClickHouseClient
+    clickhouse_connect.get_client = lambda **kwargs: FakeClickHouseClient()
+    import parsed
+    import consignments
+    client = consignments.ConsignmentsClient(workers=workers, number_attempts=attempts, backoff=backoff,
+                                             timeout=timeout)
+    consignments._client = client
+    latencies: list = []
+    fetch_port = client.fetch_port
+
+    def timed_fetch_port(body: dict):
+        start: float = time.perf_counter()
+        try:
+            return fetch_port(body)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    client.fetch_port = timed_fetch_port
+    consignments_count: int = max(1, int(rows * unique))
+    df = pd.DataFrame({
+        "line": [LINES[i % len(LINES)] for i in range(rows)],
+        "consignment": [f"BL{i % consignments_count:08d}" for i in range(rows)],
+        "container_number": [f"MSCU{i % consignments_count:07d}" for i in range(rows)],
+        "goods_name": ["ПОРОЖНИЙ КОНТЕЙНЕР" if i % 7 == 0 else f"ГРУЗ {i % 300}" for i in range(rows)],
+        "tracking_seaport": [None] * rows
+    }, dtype=object)
+    start: float = time.perf_counter()
+    parsed.ParsedDf(df).get_port()
+    seconds: float = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "requests": len(latencies),
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds, 1),
+        "requests_per_second": round(len(latencies) / seconds, 1),
+        "p50_ms": round(get_percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(get_percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(get_percentile(latencies, 99) * 1000, 1),
+        "found": int(df["tracking_seaport"].notna().sum()) if "tracking_seaport" in df.columns else 0,
+        "server": dict(server.counters)
+    }
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Mock of the consignments microservice")
+    argument_parser.add_argument("command", choices=("serve", "load"))
+    argument_parser.add_argument("--host", default="127.0.0.1")
+    argument_parser.add_argument("--port", type=int, default=0)
+    argument_parser.add_argument("--latency", default="fixed:0", help="e.g. lognormal:50:0.5")
+    argument_parser.add_argument("--error-rate", type=float, default=0, help="share of 500 answers")
+    argument_parser.add_argument("--timeout-rate", type=float, default=0, help="share of requests that hang")
+    argument_parser.add_argument("--hang-seconds", type=float, default=30)
+    argument_parser.add_argument("--not-found-rate", type=float, default=0.1, help="share of null ports")
+    argument_parser.add_argument("--rate-limit", type=float, default=0, help="requests per second, 429 over it")
+    argument_parser.add_argument("--rows", type=int, default=10000)
+    argument_parser.add_argument("--unique", type=float, default=0.3, help="share of distinct consignments")
+    argument_parser.add_argument("--workers", type=int, default=8)
+    argument_parser.add_argument("--attempts", type=int, default=3)
+    argument_parser.add_argument("--backoff", type=float, default=1)
+    argument_parser.add_argument("--timeout", type=float, default=5)
+    args = argument_parser.parse_args()
+    mock_settings: MockSettings = MockSettings(args.latency, args.error_rate, args.timeout_rate, args.hang_seconds,
+                                               args.not_found_rate, args.rate_limit)
+    if args.command == "serve":
+        mock_server: MockConsignmentsServer = MockConsignmentsServer((args.host, args.port), mock_settings)
+        print(f"Serving on {args.host}:{mock_server.server_port}")
+        mock_server.serve_forever()
+    else:
+        from benchmark import get_isolated_environment
+        os.environ.update(get_isolated_environment())
+        for variable in ("HOST", "DATABASE", "USERNAME_DB", "PASSWORD"):
+            os.environ.setdefault(variable, "load_test")
+        mock_server = start_server(mock_settings, args.host, args.port)
+        print(json.dumps(load_test(mock_server, args.rows, args.unique, args.workers, args.attempts, args.backoff,
+                                   args.timeout), indent=4))
+        mock_server.shutdown()
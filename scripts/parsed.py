@@ -1,14 +1,12 @@
 import re
 import os
-import sys
 import time
-import json
 import logging
-import requests
-from typing import Optional
+import numpy as np
 from dotenv import load_dotenv
-from clickhouse_connect import get_client
-from clickhouse_connect.driver import Client
+from cleaning import normalize_nulls
+from clickhouse import get_clickhouse
+from consignments import get_consignments_client, get_deferred_lookups
 
 # LINES = ['СИНОКОР РУС ООО', 'HEUNG-A LINE CO., LTD', 'MSC', 'SINOKOR', 'SINAKOR', 'SKR', 'sinokor',
 #          'ARKAS', 'arkas', 'Arkas',
@@ -18,90 +16,106 @@ HEUNG_AND_SINOKOR = ['СИНОКОР РУС ООО', 'HEUNG-A LINE CO., LTD', 'S
                      'HEUNG-A LINE CO., LTD', 'heung']
 IMPORT = ['импорт', 'import']
 EXPORT = ['export', 'экспорт']
+TRACKED_LINES = ('SAFETRANS', 'ARKAS', 'HEUNG-A LINE', 'MSC', 'SINOKOR')
+SKIPPED_LINES = ('REEL SHIPPING', 'MSC', 'ARKAS', 'SAFETRANS')
+REFERENCE_REFRESH_INTERVAL = int(os.environ.get('REFERENCE_REFRESH_INTERVAL', 3600))
+REFERENCE_LINES_TTL = int(os.environ.get('REFERENCE_LINES_TTL', 6 * 3600))
+ENRICHMENT_MODE = os.environ.get('ENRICHMENT_MODE', 'inline')
+ROW_COLUMNS = ('line', 'tracking_seaport', 'goods_name', 'enforce_auto_tracking', 'booking', 'consignment',
+               'container_number', 'direction', 'original_file_name')
 
 load_dotenv()
 
 
-def get_my_env_var(var_name: str) -> str:
-    try:
-        return os.environ[var_name]
-    except KeyError as e:
-        raise MissingEnvironmentVariable(f"{var_name} does not exist") from e
-
-
-class MissingEnvironmentVariable(Exception):
-    pass
-
-
-def clickhouse_client():
-    try:
-        client: Client = get_client(host=get_my_env_var('HOST'), database=get_my_env_var('DATABASE'),
-                                    username=get_my_env_var('USERNAME_DB'), password=get_my_env_var('PASSWORD'))
-        logging.info('Connection to ClickHouse is successful')
-    except Exception as ex_connect:
-        logging.info(f"Error connecting to ClickHouse: {ex_connect}")
-        sys.exit(1)
-    return client
-
-
-def unified_list_line_name():
-    client = clickhouse_client()
-    items = {}
-    line_unified_query = client.query(
-        f"SELECT * FROM reference_lines where line_unified in ('SAFETRANS','ARKAS','HEUNG-A LINE','MSC','SINOKOR')")
-    line_unified = line_unified_query.result_rows
-    for data in line_unified:
-        key, value = data[1], data[0]
-        if key not in items:
-            items[key] = [value]
-        else:
-            items[key].append(value)
-    return items
-
-
-def unified_list_line_name_skip():
-    client = clickhouse_client()
-    items = {}
-    line_unified = client.query(
-        "SELECT * FROM reference_lines "
-        "WHERE line_unified in ('REEL SHIPPING','MSC', 'ARKAS', 'SAFETRANS')"
+def fetch_reference_lines(client) -> list:
+    """
+    Get the rows of the table reference_lines of the tracked and skipped lines.
+    """
+    return client.query(
+        f"SELECT * FROM reference_lines WHERE line_unified IN {tuple(sorted(set(TRACKED_LINES + SKIPPED_LINES)))}"
     ).result_rows
 
-    for line in line_unified:
-        if line[1] in ('MSC', 'ARKAS'):
-            items[line[0]] = ["ПОРОЖ", "ПРОЖ"]
-        else:
-            items[line[0]] = []
-
-    return items
-
 
-def get_line_unified(item: dict, line_name: str):
-    for key, value in item.items():
-        if line_name in value:
-            return key
-    return line_name
-
-
-LINES = unified_list_line_name()
-HEUNG_AND_SINOKOR_REEL = unified_list_line_name_skip()
+class ReferenceLines(object):
+    """
+    Lines from the table reference_lines kept in memory and reloaded when the table changes,
+    or after ttl seconds, as the parts of tables that are not MergeTree do not show the changes.
+    """
+
+    def __init__(self, refresh_interval: int = REFERENCE_REFRESH_INTERVAL, ttl: int = REFERENCE_LINES_TTL):
+        self.refresh_interval: int = refresh_interval
+        self.ttl: int = ttl
+        self.lines: dict = {}
+        self.unified: set = set()
+        self.empties: dict = {}
+        self.version = None
+        self.checked_at: float = 0
+        self.loaded_at: float = 0
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Reload the lines if the refresh interval is over and the table has changed or the ttl is over.
+        """
+        if not force and self.checked_at and time.time() - self.checked_at < self.refresh_interval:
+            return
+        client = get_clickhouse()
+        version = client.query(
+            "SELECT max(modification_time) FROM system.parts "
+            "WHERE database = currentDatabase() AND table = 'reference_lines' AND active"
+        ).result_rows[0][0]
+        is_expired: bool = time.time() - self.loaded_at >= self.ttl
+        if force or is_expired or version is None or version != self.version:
+            self.load(fetch_reference_lines(client))
+            logging.info(f'Справочник линий загружен, линий {len(self.lines)}')
+        self.version = version
+        self.checked_at = time.time()
+
+    def load(self, line_unified: list) -> None:
+        lines: dict = {}
+        empties: dict = {}
+        for line in line_unified:
+            if line[1] in TRACKED_LINES:
+                lines.setdefault(line[0], line[1])
+            if line[1] in SKIPPED_LINES:
+                empties[line[0]] = {"ПОРОЖ", "ПРОЖ"} if line[1] in ('MSC', 'ARKAS') else set()
+        self.lines, self.empties = lines, empties
+        self.unified = set(lines.values())
+        self.loaded_at = time.time()
+
+    def use_snapshot(self, line_unified: list) -> None:
+        """
+        Load the lines fetched by another process and never reload them.
+        """
+        self.load(line_unified)
+        self.refresh_interval = float("inf")
+        self.checked_at = time.time()
+
+    def get_line_unified(self, line_name: str) -> str:
+        return self.lines.get(line_name, line_name)
+
+
+REFERENCE_LINES = ReferenceLines()
+
+
+def get_reference_lines() -> ReferenceLines:
+    """
+    Get the lines shared by every parser of the process.
+    """
+    REFERENCE_LINES.refresh()
+    return REFERENCE_LINES
 
 
 class ParsedDf:
     def __init__(self, df):
         self.df = df
-        self.url = f"http://{os.environ['IP_ADDRESS_CONSIGNMENTS']}:{os.environ['PORT']}"
-        self.headers = {
-            'Content-Type': 'application/json'
-        }
+        self.reference_lines = get_reference_lines()
 
-    @staticmethod
-    def check_lines(row: dict) -> bool:
-        line = row.get('line', '').upper()
-        goods_name = row.get('goods_name', '').upper()
-        empties = {item.upper() for item in HEUNG_AND_SINOKOR_REEL.get(line, [])}
+    def check_lines(self, row: dict) -> bool:
+        line = (row.get('line') or '').upper()
+        goods_name = (row.get('goods_name') or '').upper()
+        empties = self.reference_lines.empties.get(line)
 
-        if line in HEUNG_AND_SINOKOR_REEL and not any(name in goods_name for name in empties):
+        if empties is not None and not any(name in goods_name for name in empties):
             return False
         return True
 
@@ -120,31 +134,16 @@ class ParsedDf:
 
     def body(self, row, consignment):
         consignment_number = self.get_number_consignment(row.get(consignment))
-        line_unified = get_line_unified(LINES, row.get('line'))
+        line_unified = self.reference_lines.get_line_unified(row.get('line'))
         return {
             'line': line_unified,
             'consignment': consignment_number,
             'direction': row.get('direction', 'export'),
         }
 
-    def get_port_with_recursion(self, number_attempts: int, row, consignment) -> Optional[str]:
-        if number_attempts == 0:
-            return None
-        try:
-            body = self.body(row, consignment)
-            body = json.dumps(body)
-            response = requests.post(self.url, data=body, headers=self.headers, timeout=120)
-            response.raise_for_status()
-            return response.json()
-        except Exception as ex:
-            logging.error(f"Exception is {ex}")
-            time.sleep(30)
-            number_attempts -= 1
-            self.get_port_with_recursion(number_attempts, row, consignment)
-
     @staticmethod
     def get_consignment(row):
-        if row.get('line', '').upper() in ['ARKAS', 'MSC']:
+        if (row.get('line') or '').upper() in ['ARKAS', 'MSC']:
             return 'container_number'
         else:
             if 'booking' in row:
@@ -157,52 +156,65 @@ class ParsedDf:
     def get_port(self):
         self.add_new_columns()
         logging.info("Запросы к микросервису")
-        data = {}
-        lines = [name for sublist in list(unified_list_line_name().values()) for name in sublist]
-        for index, row in self.df.iterrows():
-            if row.get('line', '').upper() not in lines or row.get('tracking_seaport') is not None:
+        keys: dict = {}
+        bodies: dict = {}
+        rows: dict = {}
+        lines = self.reference_lines.lines
+        columns = [column for column in ROW_COLUMNS if column in self.df.columns]
+        records = normalize_nulls(self.df[columns].copy()).to_dict('records')
+        for index, row in zip(self.df.index, records):
+            if (row.get('line') or '').upper() not in lines or row.get('tracking_seaport') is not None:
                 continue
             if self.check_lines(row) and row.get('goods_name'):
                 continue
+            if not row.get('enforce_auto_tracking', True):
+                continue
             consignment = self.get_consignment(row)
-            if row.get(consignment, False) not in data:
-                data[row.get(consignment)] = {}
-                if row.get('enforce_auto_tracking', True):
-                    number_attempts = 3
-                    port = self.get_port_with_recursion(number_attempts, row, consignment)
-                    self.write_port(index, port)
-                    try:
-                        data[row.get(consignment)].setdefault('tracking_seaport',
-                                                              self.df.get('tracking_seaport')[index])
-                        data[row.get(consignment)].setdefault('is_auto_tracking',
-                                                              self.df.get('is_auto_tracking')[index])
-                        data[row.get(consignment)].setdefault('is_auto_tracking_ok',
-                                                              self.df.get('is_auto_tracking_ok')[index])
-                    except KeyError as ex:
-                        logging.info(f'Ошибка при получение ключа из DataFrame {ex}')
-            else:
-                tracking_seaport = data.get(row.get(consignment)).get('tracking_seaport') if data.get(
-                    row.get(consignment)) is not None else None
-                is_auto_tracking = data.get(row.get(consignment)).get('is_auto_tracking') if data.get(
-                    row.get(consignment)) is not None else None
-                is_auto_tracking_ok = data.get(row.get(consignment)).get('is_auto_tracking_ok') if data.get(
-                    row.get(consignment)) is not None else None
-                self.df.at[index, 'tracking_seaport'] = tracking_seaport
-                self.df.at[index, 'is_auto_tracking'] = is_auto_tracking
-                self.df.at[index, 'is_auto_tracking_ok'] = is_auto_tracking_ok
+            body = self.body(row, consignment)
+            key = (body['line'], body['consignment'], body['direction'])
+            keys[index] = key
+            bodies.setdefault(key, body)
+            rows.setdefault(key, set()).add((row.get('original_file_name'), consignment, row.get(consignment)))
+        logging.info(f'Уникальных запросов {len(bodies)} на {len(keys)} строк')
+        fetch = ENRICHMENT_MODE != 'deferred' or get_deferred_lookups() is None
+        results = get_consignments_client().lookup(list(bodies.values()), fetch=fetch)
+        ports = {key: port for key, (port, answered) in zip(bodies, results) if answered}
+        self.defer(bodies, rows, ports)
+        self.write_ports(keys, ports)
         logging.info('Обработка закончена')
 
-    def write_port(self, index, port):
-        self.df.at[index, 'is_auto_tracking'] = True
-        if port:
-            self.df.at[index, 'is_auto_tracking_ok'] = True
-            self.df.at[index, 'tracking_seaport'] = port
-        else:
-            self.df.at[index, 'is_auto_tracking_ok'] = False
-
     @staticmethod
-    def check_line(line):
-        if line not in LINES:
+    def defer(bodies: dict, rows: dict, ports: dict):
+        """
+        Queue the rows whose lookup was not answered or is deferred, to look them up later.
+        """
+        deferred = get_deferred_lookups()
+        items = [(bodies[key], *row) for key in bodies if key not in ports for row in rows[key]]
+        if deferred is not None and items:
+            deferred.add(items)
+
+    def write_ports(self, keys: dict, ports: dict):
+        """
+        Write the found ports, is_auto_tracking_ok is False for the rows whose lookup was not answered,
+        as for the ports that were not found, until the enrichment of the deferred lookups updates them.
+        The columns are added even without lookups, so every chunk of a file has the same columns.
+        """
+        for column in ('tracking_seaport', 'is_auto_tracking', 'is_auto_tracking_ok'):
+            if column not in self.df.columns:
+                self.df[column] = None
+            elif self.df[column].dtype != object:
+                self.df[column] = self.df[column].astype(object)
+        if not keys:
+            return
+        index = list(keys)
+        values = [ports.get(keys[i]) for i in index]
+        self.df.loc[index, 'is_auto_tracking'] = np.array([True] * len(index), dtype=object)
+        self.df.loc[index, 'is_auto_tracking_ok'] = np.array([bool(port) for port in values], dtype=object)
+        found = [i for i, port in zip(index, values) if port]
+        self.df.loc[found, 'tracking_seaport'] = np.array([port for port in values if port], dtype=object)
+
+    def check_line(self, line):
+        if line not in self.reference_lines.unified:
             return True
         return False
 
@@ -0,0 +1,281 @@
+import os
+import csv
+import datetime
+import functools
+import itertools
+import openpyxl
+import pandas as pd
+from __init__ import logger
+from pandas import DataFrame
+from schema import HeaderMapper, HeaderMapping
+from pandas.io.parsers import TextParser
+from contextlib import closing
+from xml.etree.ElementTree import iterparse
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+EXCEL_CHUNK_SIZE: int = int(os.environ.get("EXCEL_CHUNK_SIZE", 50000))
+SNIFF_SIZE: int = 64 * 1024
+
+XLSX_MAGIC: bytes = b"PK\x03\x04"
+XLS_MAGIC: bytes = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+SPREADSHEETML_NAMESPACE: str = "urn:schemas-microsoft-com:office:spreadsheet"
+SS: str = "{" + SPREADSHEETML_NAMESPACE + "}"
+TEXT_ENCODINGS: tuple = ("utf-8-sig", "cp1251")
+
+
+def convert_cell(value):
+    """
+    Convert a cell the same way as pandas.read_excel does with openpyxl.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def detect_format(file_path: str) -> Optional[str]:
+    """
+    Detect the format of the file by its first bytes: xlsx, xls, spreadsheetml or csv, None if it is unknown.
+    """
+    with open(file_path, "rb") as file:
+        head: bytes = file.read(SNIFF_SIZE)
+    if head.startswith(XLSX_MAGIC):
+        return "xlsx"
+    if head.startswith(XLS_MAGIC):
+        return "xls"
+    text: bytes = head.lstrip(b"\xef\xbb\xbf \t\r\n")
+    if text.startswith(b"<"):
+        return "spreadsheetml" if SPREADSHEETML_NAMESPACE.encode() in head else None
+    if b"\0" in head:
+        return None
+    return "csv" if get_encoding(head) else None
+
+
+def get_encoding(head: bytes) -> Optional[str]:
+    for encoding in TEXT_ENCODINGS:
+        try:
+            head.decode(encoding)
+        except UnicodeDecodeError as ex:
+            if ex.start < len(head) - 4:
+                continue
+        return encoding
+    return None
+
+
+def iter_xlsx_sheets(file_path: str) -> Iterator[Tuple[str, Iterator[tuple]]]:
+    """
+    Rows of the sheets of the workbook with openpyxl in read-only mode.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            sheet.reset_dimensions()
+            yield sheet.title, sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_xls_sheets(file_path: str) -> Iterator[Tuple[str, Iterator[tuple]]]:
+    """
+    Rows of the sheets of the legacy workbook with xlrd, the sheets are loaded one by one.
+    """
+    import xlrd
+
+    def convert(cell):
+        if cell.ctype == xlrd.XL_CELL_DATE:
+            return xlrd.xldate.xldate_as_datetime(cell.value, book.datemode)
+        if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+            return bool(cell.value)
+        if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+            return None
+        return cell.value
+
+    def iter_rows(sheet) -> Iterator[tuple]:
+        for index in range(sheet.nrows):
+            yield tuple(convert(cell) for cell in sheet.row(index))
+
+    book = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        for index in range(book.nsheets):
+            sheet = book.sheet_by_index(index)
+            yield sheet.name, iter_rows(sheet)
+            book.unload_sheet(index)
+    finally:
+        book.release_resources()
+
+
+def convert_spreadsheetml(data) -> object:
+    text: str = "".join(data.itertext())
+    data_type: Optional[str] = data.get(f"{SS}Type")
+    if data_type == "Number":
+        return float(text)
+    if data_type == "DateTime":
+        return datetime.datetime.fromisoformat(text[:19])
+    if data_type == "Boolean":
+        return text.strip() == "1"
+    return text
+
+
+def iter_spreadsheetml_sheets(file_path: str) -> Iterator[Tuple[str, Iterator[tuple]]]:
+    """
+    Rows of the sheets of an Excel 2003 XML workbook, parsed as a stream of elements.
+    The rows of a sheet have to be read before the next sheet.
+    """
+    events = iterparse(file_path, events=("start", "end"))
+
+    def iter_rows() -> Iterator[tuple]:
+        row_index: int = 0
+        table = None
+        for event, element in events:
+            if event == "start":
+                if element.tag == f"{SS}Table":
+                    table = element
+                continue
+            if element.tag == f"{SS}Worksheet":
+                element.clear()
+                return
+            if element.tag != f"{SS}Row":
+                continue
+            index: int = int(element.get(f"{SS}Index", row_index + 1)) - 1
+            for _ in range(index - row_index):
+                yield ()
+            row: list = []
+            for cell in element.iter(f"{SS}Cell"):
+                column: int = int(cell.get(f"{SS}Index", len(row) + 1)) - 1
+                row.extend([None] * (column - len(row)))
+                data = cell.find(f"{SS}Data")
+                row.append(None if data is None else convert_spreadsheetml(data))
+                row.extend([None] * int(cell.get(f"{SS}MergeAcross", 0)))
+            element.clear()
+            if table is not None:
+                table.remove(element)
+            row_index = index + 1
+            yield tuple(row)
+
+    for event, element in events:
+        if event == "start" and element.tag == f"{SS}Worksheet":
+            rows: Iterator[tuple] = iter_rows()
+            yield element.get(f"{SS}Name", ""), rows
+            for _ in rows:
+                pass
+
+
+def is_blank(row: tuple) -> bool:
+    return all(value is None or value == "" for value in row)
+
+
+def read_rows(header: list, rows: Iterable[tuple], chunk_size: int, dtype: Optional[dict]) -> Iterator[DataFrame]:
+    """
+    Read the rows in chunks of chunk_size rows. The empty rows at the end of the sheet, as the cells that are
+    only formatted, are dropped the same way as pandas.read_excel does.
+    """
+    chunk: list = [header]
+    blank_rows: int = 0
+    is_empty: bool = True
+    for row in rows:
+        if is_blank(row):
+            blank_rows += 1
+            continue
+        values: list = [convert_cell(value) for value in row[:len(header)]]
+        new_rows: list = [[""] * len(header)] * blank_rows + [values + [""] * (len(header) - len(values))]
+        blank_rows = 0
+        for new_row in new_rows:
+            chunk.append(new_row)
+            if len(chunk) > chunk_size:
+                yield TextParser(chunk, header=0, dtype=dtype).read()
+                chunk = [header]
+                is_empty = False
+    if len(chunk) > 1 or is_empty:
+        yield TextParser(chunk, header=0, dtype=dtype).read()
+
+
+def iter_headers(sheets: Iterator[Tuple[str, Iterator[tuple]]], skiprows: int
+                 ) -> Iterator[Tuple[str, list, Iterator[tuple]]]:
+    """
+    The name, the header and the next rows of every sheet with a header.
+    The empty cells at the end of the header are trimmed, as pandas.read_excel does.
+    """
+    try:
+        for name, rows in sheets:
+            rows = itertools.islice(rows, skiprows, None)
+            header: list = [convert_cell(value) for value in next(rows, ())]
+            while header and header[-1] == "":
+                header.pop()
+            if header:
+                yield name, header, rows
+    finally:
+        sheets.close()
+
+
+def read_sheets(open_sheets: Callable[[], Iterator[Tuple[str, Iterator[tuple]]]], chunk_size: int, skiprows: int,
+                dtype: Optional[dict], header_mapper: Optional[HeaderMapper]) -> Iterator[DataFrame]:
+    """
+    Read the data sheets of the workbook in one open: the first sheet with a header unless some of its headers
+    are unknown to the header_mapper, and the next sheets whose headers are complete for it.
+    Without a header_mapper, or if no sheet is taken, only the first sheet with a header is read.
+    """
+    if header_mapper is not None:
+        is_read: bool = False
+        with closing(iter_headers(open_sheets(), skiprows)) as sheets:
+            for index, (name, header, rows) in enumerate(sheets):
+                header_mapping: HeaderMapping = header_mapper.resolve(header)
+                if header_mapping.is_complete or (index == 0 and not header_mapping.unknown):
+                    yield from read_rows(header, rows, chunk_size, dtype)
+                    is_read = True
+                else:
+                    logger.info(f"Skip the sheet {name}, it is not a data sheet: {header_mapping}")
+        if is_read:
+            return
+    with closing(iter_headers(open_sheets(), skiprows)) as sheets:
+        for _, header, rows in sheets:
+            yield from read_rows(header, rows, chunk_size, dtype)
+            return
+    yield DataFrame()
+
+
+def read_csv_chunks(file_path: str, chunk_size: int, skiprows: int, dtype: Optional[dict]) -> Iterator[DataFrame]:
+    """
+    Read the text file with pandas.read_csv, the delimiter and the encoding are taken from its first bytes.
+    """
+    with open(file_path, "rb") as file:
+        head: bytes = file.read(SNIFF_SIZE)
+    encoding: str = get_encoding(head)
+    sample: str = head.decode(encoding, errors="ignore")
+    try:
+        delimiter: str = csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        delimiter = ","
+    df = pd.read_csv(file_path, sep=delimiter, encoding=encoding, skiprows=skiprows, dtype=dtype,
+                     chunksize=chunk_size or None)
+    if isinstance(df, DataFrame):
+        yield df
+        return
+    with df as reader:
+        yield from reader
+
+
+SHEET_READERS: dict = {
+    "xlsx": iter_xlsx_sheets,
+    "xls": iter_xls_sheets,
+    "spreadsheetml": iter_spreadsheetml_sheets,
+}
+
+
+def read_excel_chunks(file_path: str, chunk_size: int = EXCEL_CHUNK_SIZE, skiprows: int = 0,
+                      dtype: Optional[dict] = None, header_mapper: Optional[HeaderMapper] = None
+                      ) -> Iterator[DataFrame]:
+    """
+    Read the file in chunks of rows with the reader of its format: openpyxl in read-only mode for xlsx,
+    xlrd for xls, a streaming XML parser for SpreadsheetML and pandas.read_csv for text files.
+    The sheets whose headers are known to the header_mapper are read, otherwise the first sheet.
+    Unknown formats and a chunk_size of 0 are read with pandas.read_excel in one chunk.
+    """
+    file_format: Optional[str] = detect_format(file_path)
+    if file_format == "csv":
+        yield from read_csv_chunks(file_path, chunk_size, skiprows, dtype)
+    elif not chunk_size or file_format not in SHEET_READERS:
+        yield pd.read_excel(file_path, skiprows=skiprows, dtype=dtype)
+    else:
+        open_sheets: Callable = functools.partial(SHEET_READERS[file_format], file_path)
+        yield from read_sheets(open_sheets, chunk_size, skiprows, dtype, header_mapper)
@@ -1,16 +1,18 @@
 import os
-import re
 import sys
-import json
-import itertools
-import contextlib
-import numpy as np
 import pandas as pd
 from __init__ import *
 from parsed import ParsedDf
-from typing import Optional
+from dates import convert_column, date_from_file_name
+from readers import read_excel_chunks
+from metrics import measured, stage, timed
+from schema import HeaderMapper, HeaderMapping
+from cleaning import apply_dtypes, strip_strings
+from workbook_cache import cached_chunks
+from typing import Iterable, Iterator, Optional
 from pandas import DataFrame
-from datetime import datetime
+from writers import get_writer
+from datetime import date, datetime
 
 HEADERS_ENG: dict = {
     ("Дата отхода с/з",): "shipment_date",
@@ -44,8 +46,42 @@ HEADERS_ENG: dict = {
     ("Страна выгрузки",): "tracking_country",
 }
 
+HEADER_MAPPER: HeaderMapper = HeaderMapper(HEADERS_ENG, required=("container", "number", "type"))
+
 DATE_FORMATS: tuple = ("%Y-%m-%d %H:%M:%S", "%d.%m.%Y", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M")
 
+DATE_COLUMNS: tuple = ("shipped", "date_order", "arrived", "shipment_date", "date_doc")
+
+DTYPES: dict = {
+    "shipment_date": "date",
+    "date_order": "date",
+    "expeditor": "category",
+    "voyage": "category",
+    "container_type": "category",
+    "container_size": "Int64",
+    "arrived": "date",
+    "shipped": "date",
+    "port_of_destination": "category",
+    "ship_name": "category",
+    "line": "category",
+    "doc_type": "category",
+    "date_doc": "date",
+    "order_type": "category",
+    "tracking_seaport": "category",
+    "order_status": "category",
+    "tracking_country": "category",
+    "parsed_on": "date",
+    "terminal": "category",
+    "original_file_name": "category",
+    "original_file_parsed_on": "category",
+    "is_auto_tracking": "boolean",
+    "is_auto_tracking_ok": "boolean"
+}
+
+CLICKHOUSE_TABLE: str = os.environ.get("CLICKHOUSE_TABLE_EXPORT", "export")
+
+PARSER_VERSION: int = 1
+
 
 class MissingCulumnName(Exception):
     pass
@@ -55,30 +91,19 @@ class Report_Order(object):
     def __init__(self, input_file_path: str, output_folder: str):
         self.input_file_path: str = input_file_path
         self.output_folder: str = output_folder
-
-    @staticmethod
-    def convert_format_date(date: str) -> Optional[str]:
-        """
-        Convert to a date type.
-        """
-        for date_format in DATE_FORMATS:
-            with contextlib.suppress(ValueError):
-                return str(datetime.strptime(date, date_format).date())
+        self.original_file_parsed_on: str = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
     @staticmethod
     def rename_columns(df: DataFrame) -> None:
         """
-        Rename of a columns.
+        Rename of a columns, the missing optional columns are added empty.
         """
-        dict_columns_eng: dict = {}
-        for column, columns in itertools.product(df.columns, HEADERS_ENG):
-            for column_eng in columns:
-                column_strip: str = column.strip()
-                if column_strip == column_eng.strip():
-                    dict_columns_eng[column] = HEADERS_ENG[columns]
-        if len(dict_columns_eng) != len(df.iloc[0]):
-            raise MissingCulumnName('Column naming error')
-        df.rename(columns=dict_columns_eng, inplace=True)
+        header_mapping: HeaderMapping = HEADER_MAPPER.resolve(df.columns)
+        if not header_mapping.is_complete:
+            raise MissingCulumnName(f'Column naming error: {header_mapping}')
+        df.rename(columns=header_mapping.mapping, inplace=True)
+        for column in header_mapping.missing:
+            df[column] = None
 
     @staticmethod
     def change_type(df: DataFrame) -> None:
@@ -92,7 +117,7 @@ class Report_Order(object):
 
     @staticmethod
     def change_goods_name(goods_name: str) -> str:
-        if goods_name:
+        if not pd.isna(goods_name) and goods_name:
             return goods_name
         return "ПОРОЖНИЙ КОНТЕЙНЕР"
 
@@ -104,13 +129,11 @@ class Report_Order(object):
         """
         Check the date at the beginning of the file.
         """
-        date_previous: re.Match = re.match(r'\d{2,4}.\d{1,2}', os.path.basename(self.input_file_path))
-        date_previous: str = f'{date_previous.group()}.01' if date_previous else date_previous
+        date_previous: Optional[date] = date_from_file_name(self.input_file_path)
         if date_previous is None:
             telegram(f'Не указана дата в файле {self.input_file_path}')
             raise AssertionError('Date not in file name!')
-        else:
-            return str(datetime.strptime(date_previous, "%Y.%m.%d").date())
+        return str(date_previous)
 
     def add_new_columns(self, df: DataFrame, parsed_on) -> None:
         """
@@ -121,42 +144,72 @@ class Report_Order(object):
         # df['month'] = pd.to_datetime(df['date']).dt.month
         # df['year'] = pd.to_datetime(df['date']).dt.year
         df['original_file_name'] = os.path.basename(self.input_file_path)
-        df['original_file_parsed_on'] = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        df['original_file_parsed_on'] = self.original_file_parsed_on
 
     def convert_format_to_date(self, df: DataFrame) -> None:
-        df["shipped"] = df["shipped"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
-        df["date_order"] = df["date_order"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
-        df["arrived"] = df["arrived"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
-        df["shipment_date"] = df["shipment_date"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
-        df["date_doc"] = df["date_doc"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
+        for column in DATE_COLUMNS:
+            df[column] = convert_column(df[column], DATE_FORMATS)
 
-    def write_to_json(self, parsed_data: list) -> None:
+    def write_to_json(self, chunks: Iterable[DataFrame]) -> None:
         """
         Write data to json.
         """
         basename: str = os.path.basename(self.input_file_path)
         output_file_path: str = os.path.join(self.output_folder, f'{basename}.json')
-        with open(f"{output_file_path}", 'w', encoding='utf-8') as f:
-            json.dump(parsed_data, f, ensure_ascii=False, indent=4, default=serialize_datetime)
+        with get_writer(output_file_path, CLICKHOUSE_TABLE) as writer:
+            for df in chunks:
+                with stage("write", df):
+                    writer.write(df)
 
-    def main(self) -> None:
+    def clean(self, df: DataFrame) -> DataFrame:
         """
-        The main function where we read the Excel file and write the file to json.
+        Clean a chunk of rows of the Excel file, the result is kept in the workbook cache.
         """
-        df: DataFrame = pd.read_excel(self.input_file_path, skiprows=1, dtype={"№ конт.": str, "ТНВЭД": str})
         df = df.dropna(axis=0, how='all')
-        parsed_on = self.check_date_in_begin_file()
+        if df.empty:
+            return df
         self.rename_columns(df)
         self.change_columns(df)
-        df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-        self.add_new_columns(df, parsed_on)
-        self.convert_format_to_date(df)
+        with stage("strip"):
+            df = strip_strings(df)
+        with stage("dates"):
+            self.convert_format_to_date(df)
         df["container_size"] = pd.to_numeric(df["container_size"], errors='coerce').astype('Int64')
-        df = df.replace({np.nan: None, "NaT": None})
+        with stage("dtypes"):
+            df = apply_dtypes(df, DTYPES)
         df["goods_name"] = df["goods_name"].apply(lambda x: self.change_goods_name(x))
-        ParsedDf(df).get_port()
-        df = df.replace({np.nan: None, "NaT": None})
-        self.write_to_json(df.to_dict('records'))
+        return df
+
+    def read(self) -> Iterator[DataFrame]:
+        """
+        Read the Excel file in cleaned chunks of rows.
+        """
+        chunks: Iterable[DataFrame] = timed(read_excel_chunks(self.input_file_path, skiprows=1,
+                                                              dtype={"№ конт.": str, "ТНВЭД": str},
+                                                              header_mapper=HEADER_MAPPER))
+        return (self.clean(df) for df in chunks)
+
+    def transform(self, df: DataFrame, parsed_on: str) -> DataFrame:
+        """
+        Transform a cleaned chunk of rows of the Excel file.
+        """
+        if df.empty:
+            return df
+        self.add_new_columns(df, parsed_on)
+        df = apply_dtypes(df, DTYPES)
+        with stage("get_port", df):
+            ParsedDf(df).get_port()
+        return apply_dtypes(df, DTYPES)
+
+    @measured
+    def main(self) -> None:
+        """
+        The main function where we read the Excel file and write the file to json.
+        """
+        parsed_on: str = self.check_date_in_begin_file()
+        chunks: Iterable[DataFrame] = cached_chunks(self.input_file_path, type(self).__name__, PARSER_VERSION,
+                                                    self.read)
+        self.write_to_json(self.transform(df, parsed_on) for df in chunks)
 
 
 if __name__ == "__main__":
@@ -1,16 +1,16 @@
 import os
 import sys
-import json
-import itertools
-import contextlib
-import numpy as np
-import pandas as pd
 from __init__ import *
-from typing import Optional
+from typing import Iterable, Optional
 from pandas import DataFrame, Series
+from writers import JsonWriter
 from datetime import datetime
-from clickhouse_connect import get_client
-from clickhouse_connect.driver import Client
+from dates import convert_column
+from readers import read_excel_chunks
+from metrics import count, measured, stage, timed
+from schema import HeaderMapper
+from cleaning import normalize_nulls, strip_strings
+from clickhouse import get_clickhouse
 
 HEADERS_ENG: dict = {
     ("Дата отхода с/з",): "shipment_date",
@@ -40,6 +40,8 @@ HEADERS_ENG: dict = {
     ("Отправитель",): "shipper_name"
 }
 
+HEADER_MAPPER: HeaderMapper = HeaderMapper(HEADERS_ENG)
+
 DATE_FORMATS: tuple = (
     "%Y-%m-%dT%H:%M:%SZ",
     "%Y-%m-%dT%H:%M:%S",
@@ -51,49 +53,71 @@ DATE_FORMATS: tuple = (
     "%Y-%m-%d"
 )
 
+DATE_COLUMNS: tuple = ("shipment_date", "date_order", "arrived", "shipped", "date_doc", "parsed_on")
+
+UPDATE_COLUMNS: tuple = (
+    ("parsed_on", True),
+    ("shipment_date", True),
+    ("month_parsed_on", False),
+    ("year_parsed_on", False),
+    ("terminal", True),
+    ("line", True),
+    ("ship_name", True),
+    ("voyage", True),
+    ("consignment", True),
+    ("container_number", True),
+    ("container_size", False),
+    ("container_type", True),
+    ("container_count", False),
+    ("goods_name", True),
+    ("tnved", True),
+    ("goods_weight_with_package", True),
+    ("shipper_name", True),
+    ("consignee_name", True),
+    ("expeditor", True),
+    ("tracking_country", True),
+    ("tracking_seaport", True),
+    ("gtd_number", True),
+    ("shipped", True),
+    ("order_number_full", True),
+    ("booking", True),
+    ("mopog", True),
+    ("tare_weight", False),
+    ("date_order", True),
+    ("net", False),
+    ("gross", False),
+    ("arrived", True),
+    ("port_of_destination", True),
+    ("no_doc", True),
+    ("doc_type", True),
+    ("date_doc", True),
+    ("order_type", True),
+    ("order_status", True),
+    ("is_auto_tracking", True),
+    ("is_auto_tracking_ok", True),
+    ("original_file_name", True),
+    ("original_file_parsed_on", True),
+)
+
+OPTIONAL_COLUMNS: tuple = ("parsed_on", "month_parsed_on", "year_parsed_on")
+
+UPDATE_BATCH_SIZE: int = int(os.environ.get("UPDATE_BATCH_SIZE", 200))
+MAX_QUERY_SIZE: int = 64 * 1024 * 1024
+
 
 class Report_Order_Update(object):
     def __init__(self, input_file_path: str, output_folder: str):
-        self.client = self.connect_clickhouse()
+        self.client = get_clickhouse()
         self.input_file_path: str = input_file_path
         self.output_folder: str = output_folder
-
-    @staticmethod
-    def connect_clickhouse():
-        """
-                Connecting to clickhouse.
-                :return: Client ClickHouse.
-                """
-        try:
-            client: Client = get_client(host=get_my_env_var('HOST'), database=get_my_env_var('DATABASE'),
-                                        username=get_my_env_var('USERNAME_DB'), password=get_my_env_var('PASSWORD'))
-            logger.info('Connection to ClickHouse is successful')
-        except Exception as ex_connect:
-            logger.info(f"Error connecting to ClickHouse: {ex_connect}")
-            sys.exit(1)
-        return client
-
-    @staticmethod
-    def convert_format_date(date: str) -> Optional[str]:
-        """
-        Convert to a date type.
-        """
-        for date_format in DATE_FORMATS:
-            with contextlib.suppress(ValueError):
-                return str(datetime.strptime(date, date_format).date())
+        self.original_file_parsed_on: str = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
     @staticmethod
     def rename_columns(df: DataFrame) -> None:
         """
         Rename of a columns.
         """
-        dict_columns_eng: dict = {}
-        for column, columns in itertools.product(df.columns, HEADERS_ENG):
-            for column_eng in columns:
-                column_strip: str = column.strip()
-                if column_strip == column_eng.strip():
-                    dict_columns_eng[column] = HEADERS_ENG[columns]
-        df.rename(columns=dict_columns_eng, inplace=True)
+        HEADER_MAPPER.rename(df)
 
     @staticmethod
     def change_type(df: DataFrame) -> None:
@@ -119,17 +143,13 @@ class Report_Order_Update(object):
         # df['month'] = pd.to_datetime(df['date']).dt.month
         # df['year'] = pd.to_datetime(df['date']).dt.year
         df['original_file_name'] = os.path.basename(self.input_file_path)
-        df['original_file_parsed_on'] = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        df['original_file_parsed_on'] = self.original_file_parsed_on
 
     def convert_format_to_date(self, df: DataFrame) -> None:
         """convert format to date."""
         logger.info("Converting the format of the date")
-        df["shipment_date"] = df["shipment_date"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
-        df["date_order"] = df["date_order"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
-        df["arrived"] = df["arrived"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
-        df["shipped"] = df["shipped"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
-        df["date_doc"] = df["date_doc"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
-        df["parsed_on"] = df["parsed_on"].apply(lambda x: self.convert_format_date(str(x)) if x else None)
+        for column in DATE_COLUMNS:
+            df[column] = convert_column(df[column], DATE_FORMATS)
 
     @staticmethod
     def change_format_value(value, flag=False):
@@ -141,58 +161,52 @@ class Report_Order_Update(object):
         return value
 
     def clickhouse_update(self, row: Series):
+        values: str = ",\n".join(
+            f"{column} = {self.change_format_value(self.get_value(row, column), flag)}"
+            for column, flag in UPDATE_COLUMNS
+        )
         query = f"""
         ALTER TABLE default.export UPDATE
-        parsed_on = {self.change_format_value(row.get("parsed_on"), True)},
-        shipment_date = {self.change_format_value(row["shipment_date"], True)},
-        month_parsed_on = {self.change_format_value(row.get("month_parsed_on"))},
-        year_parsed_on = {self.change_format_value(row.get("year_parsed_on"))},
-        terminal = {self.change_format_value(row["terminal"], True)},
-        line = {self.change_format_value(row["line"], True)},
-        ship_name = {self.change_format_value(row["ship_name"], True)},
-        voyage = {self.change_format_value(row["voyage"], True)},
-        consignment = {self.change_format_value(row["consignment"], True)},
-        container_number = {self.change_format_value(row["container_number"], True)},
-        container_size = {self.change_format_value(row["container_size"])},
-        container_type = {self.change_format_value(row["container_type"], True)},
-        container_count = {self.change_format_value(row["container_count"])},
-        goods_name = {self.change_format_value(row["goods_name"], True)},
-        tnved = {self.change_format_value(row["tnved"], True)},
-        goods_weight_with_package = {self.change_format_value(row["goods_weight_with_package"], True)},
-        shipper_name = {self.change_format_value(row["shipper_name"], True)},
-        consignee_name = {self.change_format_value(row["consignee_name"], True)},
-        expeditor = {self.change_format_value(row["expeditor"], True)},
-        tracking_country = {self.change_format_value(row["tracking_country"], True)},
-        tracking_seaport = {self.change_format_value(row["tracking_seaport"], True)},
-        gtd_number = {self.change_format_value(row["gtd_number"], True)},
-        shipped = {self.change_format_value(row["shipped"], True)},
-        order_number_full = {self.change_format_value(row["order_number_full"], True)},
-        booking = {self.change_format_value(row["booking"], True)},
-        mopog = {self.change_format_value(row["mopog"], True)},
-        tare_weight = {self.change_format_value(row["tare_weight"])},
-        date_order = {self.change_format_value(row["date_order"], True)},
-        net = {self.change_format_value(row["net"])},
-        gross = {self.change_format_value(row["gross"])},
-        arrived = {self.change_format_value(row["arrived"], True)},
-        port_of_destination = {self.change_format_value(row["port_of_destination"], True)},
-        no_doc = {self.change_format_value(row["no_doc"], True)},
-        doc_type = {self.change_format_value(row["doc_type"], True)},
-        date_doc = {self.change_format_value(row["date_doc"], True)},
-        order_type = {self.change_format_value(row["order_type"], True)},
-        order_status = {self.change_format_value(row["order_status"], True)},
-        is_auto_tracking = {self.change_format_value(row["is_auto_tracking"], True)},
-        is_auto_tracking_ok = {self.change_format_value(row["is_auto_tracking_ok"], True)},
-        original_file_name = {self.change_format_value(row["original_file_name"], True)},
-        original_file_parsed_on = {self.change_format_value(row["original_file_parsed_on"], True)}
+        {values}
         WHERE uuid = '{row["uuid"]}'
         """
 
         self.client.query(query)
 
-    def update_date_in_table(self, df: DataFrame) -> None:
-        """update data in table clickhouse to uuid."""
+    @staticmethod
+    def get_value(row: Series, column: str):
+        return row.get(column) if column in OPTIONAL_COLUMNS else row[column]
+
+    def get_column_types(self) -> dict:
+        """get types of the columns of the table export."""
+        return dict(self.client.query(
+            "SELECT name, type FROM system.columns WHERE database = 'default' AND table = 'export'"
+        ).result_rows)
+
+    def clickhouse_update_batch(self, df: DataFrame, column_types: dict) -> None:
+        """update a batch of rows with one mutation, the new values are picked by uuid."""
+        uuids: list = [f"'{uuid}'" for uuid in df["uuid"]]
+        rows: list = df.to_dict('records')
+        assignments: list = []
+        for column, flag in UPDATE_COLUMNS:
+            branches: str = ", ".join(
+                f"uuid = {uuid}, CAST({self.change_format_value(self.get_value(row, column), flag)}, "
+                f"'{column_types[column]}')"
+                for uuid, row in zip(uuids, rows)
+            )
+            assignments.append(f"{column} = multiIf({branches}, {column})")
+        values: str = ",\n".join(assignments)
+        query = f"""
+        ALTER TABLE default.export UPDATE
+        {values}
+        WHERE uuid IN ({", ".join(uuids)})
+        """
+
+        self.client.command(query, settings={"max_query_size": MAX_QUERY_SIZE})
+
+    def update_rows(self, df: DataFrame) -> list:
+        """update data in table clickhouse row by row, return uuid of rows with errors."""
         errors = []
-        logger.info("Updating data in the table export clickhouse")
         for index, row in df.iterrows():
             try:
                 self.clickhouse_update(row)
@@ -200,20 +214,38 @@ class Report_Order_Update(object):
                 logger.info(f"Error updating data in the export clickhouse table : \n{ex}")
                 errors.append(row["uuid"])
                 continue
+        return errors
+
+    def update_date_in_table(self, df: DataFrame) -> None:
+        """update data in table clickhouse to uuid."""
+        errors = []
+        logger.info("Updating data in the table export clickhouse")
+        column_types: dict = self.get_column_types()
+        for start in range(0, len(df), UPDATE_BATCH_SIZE):
+            batch: DataFrame = df.iloc[start:start + UPDATE_BATCH_SIZE]
+            try:
+                self.clickhouse_update_batch(batch, column_types)
+            except Exception as ex:
+                logger.info(f"Error updating a batch of data in the export clickhouse table, "
+                            f"updating row by row : \n{ex}")
+                count("update_batch_failures")
+                errors.extend(self.update_rows(batch))
         if errors:
             errors = '\n'.join(errors)
             logger.info(f"Error updating data in the export clickhouse table : \n{errors}")
             telegram(f"Ошибка при обновлении данных в таблице export clickhouse\n"
                      f"uuid: {errors}")
 
-    def write_to_json(self, parsed_data: list) -> None:
+    def write_to_json(self, chunks: Iterable[DataFrame]) -> None:
         """
         Write data to json.
         """
         basename: str = os.path.basename(self.input_file_path)
         output_file_path: str = os.path.join(self.output_folder, f'{basename}.json')
-        with open(f"{output_file_path}", 'w', encoding='utf-8') as f:
-            json.dump(parsed_data, f, ensure_ascii=False, indent=4, default=serialize_datetime)
+        with JsonWriter(output_file_path) as writer:
+            for df in chunks:
+                with stage("write", df):
+                    writer.write(df)
 
     @staticmethod
     def convert_format_bool(value: Optional[float]) -> Optional[bool]:
@@ -229,18 +261,23 @@ class Report_Order_Update(object):
         df["is_auto_tracking"] = df["is_auto_tracking"].apply(lambda x: self.convert_format_bool(x))
         df["is_auto_tracking_ok"] = df["is_auto_tracking_ok"].apply(lambda x: self.convert_format_bool(x))
 
+    @measured
     def main(self) -> None:
         """
         The main function where we read the Excel file and write the file to json.
         """
         logger.info(f"Reading the Excel file : {os.path.basename(self.input_file_path)}")
-        df: DataFrame = pd.read_excel(self.input_file_path, dtype={"№ конт.": str})
-        df = df.dropna(axis=0, how='all')
-        df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-        self.convert_format_to_date(df)
-        df = df.replace({np.nan: None, "NaT": None})
-        self.convert_df_format_bool(df)
-        self.update_date_in_table(df)
+        for df in timed(read_excel_chunks(self.input_file_path, dtype={"№ конт.": str})):
+            df = df.dropna(axis=0, how='all')
+            with stage("strip"):
+                df = strip_strings(df)
+            with stage("dates"):
+                self.convert_format_to_date(df)
+            with stage("nulls"):
+                df = normalize_nulls(df)
+            self.convert_df_format_bool(df)
+            with stage("update", df):
+                self.update_date_in_table(df)
         logger.info("Finished updating data in the table export clickhouse")
 
 
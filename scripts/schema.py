@@ -0,0 +1,79 @@
+from __init__ import logger
+from pandas import DataFrame
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def normalize_header(name) -> str:
+    """
+    Strip the header, collapse its whitespace and casefold it.
+    """
+    return " ".join(str(name).split()).casefold()
+
+
+class HeaderMapping(object):
+    """
+    Columns of a file renamed to the canonical names, the unknown columns and the missing canonical names.
+    """
+
+    def __init__(self, mapping: Dict[str, str], unknown: List[str], missing: List[str],
+                 missing_required: List[str]):
+        self.mapping: Dict[str, str] = mapping
+        self.unknown: List[str] = unknown
+        self.missing: List[str] = missing
+        self.missing_required: List[str] = missing_required
+
+    @property
+    def is_complete(self) -> bool:
+        """
+        No unknown column and no missing required column, the other missing columns are optional.
+        """
+        return not self.unknown and not self.missing_required
+
+    def __str__(self) -> str:
+        optional: list = [column for column in self.missing if column not in self.missing_required]
+        return (f"unknown columns {self.unknown}, missing required columns {self.missing_required}, "
+                f"missing optional columns {optional}")
+
+
+class HeaderMapper(object):
+    """
+    Maps the headers of the files of a parser to the canonical names in one pass over the columns.
+    The keys of the headers are an alias or a tuple of aliases, the mapping is cached by the headers of a file.
+    Every canonical name is required unless the required names are given.
+    """
+
+    def __init__(self, headers: dict, required: Optional[tuple] = None):
+        self.aliases: Dict[str, str] = {}
+        for aliases, canonical in headers.items():
+            for alias in aliases if isinstance(aliases, tuple) else (aliases,):
+                self.aliases[normalize_header(alias)] = canonical
+        self.canonical: Tuple[str, ...] = tuple(dict.fromkeys(headers.values()))
+        self.required: Tuple[str, ...] = self.canonical if required is None else tuple(required)
+        self.cache: Dict[tuple, HeaderMapping] = {}
+
+    def resolve(self, columns: Iterable) -> HeaderMapping:
+        signature: tuple = tuple(columns)
+        if signature not in self.cache:
+            mapping: dict = {}
+            unknown: list = []
+            for column in signature:
+                canonical = self.aliases.get(normalize_header(column))
+                if canonical is None:
+                    unknown.append(column)
+                else:
+                    mapping[column] = canonical
+            found: set = set(mapping.values())
+            missing: list = [canonical for canonical in self.canonical if canonical not in found]
+            missing_required: list = [canonical for canonical in self.required if canonical not in found]
+            self.cache[signature] = HeaderMapping(mapping, unknown, missing, missing_required)
+            if unknown or missing:
+                logger.info(f"Headers of the file: {self.cache[signature]}")
+        return self.cache[signature]
+
+    def rename(self, df: DataFrame) -> HeaderMapping:
+        """
+        Rename the columns of the DataFrame in place.
+        """
+        header_mapping: HeaderMapping = self.resolve(df.columns)
+        df.rename(columns=header_mapping.mapping, inplace=True)
+        return header_mapping
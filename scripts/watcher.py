@@ -0,0 +1,114 @@
+import os
+import ctypes
+import select
+import struct
+import threading
+import ctypes.util
+from __init__ import logger
+from typing import Callable, Dict, List, Optional
+
+IN_CLOSE_WRITE: int = 0x00000008
+IN_MOVED_TO: int = 0x00000080
+IN_Q_OVERFLOW: int = 0x00004000
+IN_NONBLOCK: int = 0o4000
+IN_CLOEXEC: int = 0o2000000
+
+EVENT_HEADER: struct.Struct = struct.Struct("iIII")
+BUFFER_SIZE: int = 64 * 1024
+
+INOTIFY: str = os.environ.get("DAEMON_INOTIFY", "auto")
+MOUNTS_PATH: str = "/proc/mounts"
+NETWORK_FILESYSTEMS: tuple = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "ncpfs", "9p", "afs", "ceph", "glusterfs",
+                              "lustre", "gpfs", "fuse.sshfs", "fuse.glusterfs", "fuse.cephfs", "fuse.s3fs")
+
+
+class InotifyWatcher(object):
+    """
+    Calls on_file with the path of every file closed after writing or moved into the watched directories.
+    On an overflow of the queue of events on_file is called with None, the directories have to be scanned.
+    """
+
+    def __init__(self, paths: List[str], on_file: Callable[[Optional[str]], None]):
+        self.on_file: Callable[[Optional[str]], None] = on_file
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd: int = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths: Dict[int, str] = {}
+        for path in paths:
+            wd: int = self.libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+            self.paths[wd] = path
+        self.thread: threading.Thread = threading.Thread(target=self.run, name="inotify", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def read_events(self) -> None:
+        try:
+            data: bytes = os.read(self.fd, BUFFER_SIZE)
+        except BlockingIOError:
+            return
+        offset: int = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name: bytes = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                logger.error("The queue of inotify events overflowed")
+                self.on_file(None)
+            elif wd in self.paths and name:
+                self.on_file(os.path.join(self.paths[wd], os.fsdecode(name)))
+
+    def run(self) -> None:
+        while True:
+            readable, _, _ = select.select([self.fd], [], [])
+            if readable:
+                self.read_events()
+
+
+def get_filesystem(path: str) -> Optional[str]:
+    """
+    Get the type of the filesystem mounted at the directory, None if the mounts can not be read.
+    """
+    path = os.path.realpath(path)
+    filesystem: Optional[str] = None
+    mount_point_length: int = -1
+    try:
+        with open(MOUNTS_PATH) as f:
+            for line in f:
+                fields: list = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point: str = fields[1].replace("\\040", " ")
+                prefix: str = mount_point.rstrip("/") + "/"
+                if (path == mount_point or path.startswith(prefix)) and len(mount_point) > mount_point_length:
+                    filesystem, mount_point_length = fields[2], len(mount_point)
+    except OSError:
+        return None
+    return filesystem
+
+
+def start_watcher(paths: List[str], on_file: Callable[[Optional[str]], None]) -> Optional[InotifyWatcher]:
+    """
+    Start watching the directories with inotify, None if the directories have to be polled: inotify is not
+    available, DAEMON_INOTIFY is 0, or a directory is on a network filesystem, where inotify does not see
+    the files written by the other hosts. DAEMON_INOTIFY=1 uses inotify on network filesystems too.
+    """
+    if INOTIFY == "0":
+        logger.info("inotify is turned off, polling the directories")
+        return None
+    network: list = [path for path in paths if get_filesystem(path) in NETWORK_FILESYSTEMS]
+    if network and INOTIFY != "1":
+        logger.info(f"The directories {', '.join(network)} are on a network filesystem, polling the directories")
+        return None
+    try:
+        watcher: InotifyWatcher = InotifyWatcher(paths, on_file)
+    except (OSError, AttributeError) as ex:
+        logger.info(f"inotify is not available, polling the directories : {ex}")
+        return None
+    watcher.start()
+    return watcher
@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import pandas as pd
+from __init__ import get_data_path, logger
+from pandas import DataFrame
+from ledger import file_digest
+from metrics import count, timed
+from typing import Callable, Iterable, Iterator, List, Optional
+
+WORKBOOK_CACHE_PATH: str = get_data_path(os.environ.get("WORKBOOK_CACHE_PATH", ""))
+WORKBOOK_CACHE_MAX_BYTES: int = int(os.environ.get("WORKBOOK_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+
+class WorkbookCache(object):
+    """
+    Cleaned chunks of the parsed files, pickled in a directory per content hash, parser and parser version.
+    The least recently used entries are removed when the directory grows over max_bytes.
+    """
+
+    def __init__(self, path: str = WORKBOOK_CACHE_PATH, max_bytes: int = WORKBOOK_CACHE_MAX_BYTES):
+        self.path: str = path
+        self.max_bytes: int = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def get_key(file_path: str, parser: str, version: int) -> str:
+        return f"{parser}-{version}-pandas{pd.__version__}-{file_digest(file_path)}"
+
+    def load(self, key: str) -> Optional[Iterator[DataFrame]]:
+        """
+        The chunks of the entry, None if it is not cached.
+        """
+        entry: str = os.path.join(self.path, key)
+        try:
+            os.utime(entry)
+            names: List[str] = sorted(os.listdir(entry))
+        except FileNotFoundError:
+            return None
+        return (pd.read_pickle(os.path.join(entry, name)) for name in names)
+
+    def store(self, key: str, chunks: Iterable[DataFrame]) -> Iterator[DataFrame]:
+        """
+        Pass the chunks through and cache them. The entry is added as soon as the chunks are exhausted,
+        before the last chunk is passed on, so a file that fails on its last chunk is cached.
+        """
+        temp_path: Optional[str] = tempfile.mkdtemp(prefix=".", dir=self.path)
+        try:
+            previous: Optional[DataFrame] = None
+            for index, df in enumerate(chunks):
+                df.to_pickle(os.path.join(temp_path, f"{index:06d}.pkl"))
+                if previous is not None:
+                    yield previous
+                previous = df
+            self.add(key, temp_path)
+            temp_path = None
+            if previous is not None:
+                yield previous
+        finally:
+            if temp_path is not None:
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+    def add(self, key: str, temp_path: str) -> None:
+        try:
+            os.rename(temp_path, os.path.join(self.path, key))
+        except OSError:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits into max_bytes.
+        """
+        entries: list = []
+        with os.scandir(self.path) as iterator:
+            for entry in iterator:
+                if entry.name.startswith(".") or not entry.is_dir():
+                    continue
+                size: int = sum(file.stat().st_size for file in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+        total: int = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted {os.path.basename(path)} from the workbook cache")
+
+
+_cache: Optional[WorkbookCache] = None
+
+
+def get_workbook_cache() -> Optional[WorkbookCache]:
+    """
+    Get the cache of the process, None unless WORKBOOK_CACHE_PATH is set, a relative path is in DATA_DIR.
+    """
+    global _cache
+    if _cache is None and WORKBOOK_CACHE_PATH:
+        _cache = WorkbookCache()
+    return _cache
+
+
+def cached_chunks(file_path: str, parser: str, version: int,
+                  read: Callable[[], Iterable[DataFrame]]) -> Iterator[DataFrame]:
+    """
+    The cleaned chunks of the file from the cache, or from read, which are then cached.
+    """
+    cache: Optional[WorkbookCache] = get_workbook_cache()
+    if cache is None:
+        yield from read()
+        return
+    key: str = cache.get_key(file_path, parser, version)
+    chunks: Optional[Iterator[DataFrame]] = cache.load(key)
+    if chunks is None:
+        yield from cache.store(key, read())
+        return
+    count("workbook_cache_hits")
+    logger.info(f"Read the cleaned chunks of {file_path} from the workbook cache")
+    yield from timed(chunks, "cache")
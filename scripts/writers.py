@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import hashlib
+import textwrap
+import pandas as pd
+from typing import Optional
+from pandas import DataFrame
+from metrics import count
+from cleaning import normalize_nulls
+from clickhouse import get_clickhouse
+from __init__ import logger, serialize_datetime
+
+OUTPUT_FORMATS: tuple = ("pretty", "compact", "ndjson")
+
+OUTPUT_FORMAT: str = os.environ.get("OUTPUT_FORMAT", "pretty")
+OUTPUT_SINK: str = os.environ.get("OUTPUT_SINK", "json")
+CHUNK_SIZE: int = 10000
+
+INSERT_BATCH_SIZE: int = int(os.environ.get("INSERT_BATCH_SIZE", 50000))
+INSERT_ATTEMPTS: int = int(os.environ.get("INSERT_ATTEMPTS", 3))
+INSERT_BACKOFF: float = float(os.environ.get("INSERT_BACKOFF", 5))
+
+
+class JsonWriter(object):
+    """
+    Write the rows of DataFrames to a json file chunk by chunk.
+    The file is written under a temporary name and renamed when it is complete.
+    pretty is the same output as json.dump(indent=4), compact has no whitespace, ndjson is a row per line.
+    """
+
+    def __init__(self, output_file_path: str, output_format: str = OUTPUT_FORMAT):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {output_format}")
+        self.output_file_path: str = output_file_path
+        self.output_format: str = output_format
+        self.tmp_file_path: str = os.path.join(
+            os.path.dirname(output_file_path), f".{os.path.basename(output_file_path)}.tmp"
+        )
+        self.file = None
+        self.rows: int = 0
+
+    def __enter__(self) -> "JsonWriter":
+        self.file = open(self.tmp_file_path, 'w', encoding='utf-8')
+        if self.output_format != "ndjson":
+            self.file.write("[")
+        return self
+
+    def write(self, df: DataFrame) -> None:
+        """
+        Write the rows of the DataFrame, NaN, NA and NaT are written as null.
+        """
+        for start in range(0, len(df), CHUNK_SIZE):
+            for record in normalize_nulls(df.iloc[start:start + CHUNK_SIZE].copy()).to_dict('records'):
+                self.write_record(record)
+
+    def write_record(self, record: dict) -> None:
+        if self.output_format == "ndjson":
+            self.file.write(json.dumps(record, ensure_ascii=False, default=serialize_datetime))
+            self.file.write("\n")
+        elif self.output_format == "compact":
+            self.file.write("," if self.rows else "")
+            self.file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=serialize_datetime))
+        else:
+            self.file.write(",\n" if self.rows else "\n")
+            self.file.write(textwrap.indent(
+                json.dumps(record, ensure_ascii=False, indent=4, default=serialize_datetime), "    "
+            ))
+        self.rows += 1
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if exc_type is not None:
+            self.file.close()
+            os.remove(self.tmp_file_path)
+            return False
+        if self.output_format == "pretty" and self.rows:
+            self.file.write("\n]")
+        elif self.output_format != "ndjson":
+            self.file.write("]")
+        self.file.close()
+        os.replace(self.tmp_file_path, self.output_file_path)
+        return False
+
+
+class ClickHouseWriter(object):
+    """
+    Insert the rows of DataFrames straight into a table of ClickHouse in compressed native batches.
+    A batch is retried with the same deduplication token, so a retry does not insert it twice.
+    When a batch still fails, it and the following rows are written to the json file instead.
+    """
+
+    def __init__(self, output_file_path: str, table: str, batch_size: int = INSERT_BATCH_SIZE):
+        self.output_file_path: str = output_file_path
+        self.table: str = table
+        self.batch_size: int = batch_size
+        self.client = None
+        self.column_types: dict = {}
+        self.batches: int = 0
+        self.fallback: Optional[JsonWriter] = None
+
+    def __enter__(self) -> "ClickHouseWriter":
+        self.client = get_clickhouse()
+        self.column_types = {row[0]: row[1] for row in self.client.query(f"DESCRIBE TABLE {self.table}").result_rows}
+        return self
+
+    def write(self, df: DataFrame) -> None:
+        """
+        Insert the rows of the DataFrame.
+        """
+        for start in range(0, len(df), self.batch_size):
+            batch: DataFrame = df.iloc[start:start + self.batch_size]
+            if self.fallback is None:
+                try:
+                    self.insert(batch)
+                    continue
+                except Exception as ex:
+                    logger.error(f"Error inserting into {self.table}, the rest of the rows go to "
+                                 f"{self.output_file_path} : {ex}")
+                    self.fallback = JsonWriter(self.output_file_path).__enter__()
+            self.fallback.write(batch)
+
+    def convert_types(self, df: DataFrame) -> DataFrame:
+        """
+        Keep the columns of the table and convert the values to the types of the columns, the nulls to None.
+        """
+        unknown: list = [column for column in df.columns if column not in self.column_types]
+        if unknown:
+            logger.info(f"Columns {unknown} are not in the table {self.table}")
+        df = df[[column for column in df.columns if column in self.column_types]].copy()
+        for column in df.columns:
+            column_type: str = self.column_types[column]
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+            if "Date" in column_type:
+                dates = pd.to_datetime(values, errors="coerce")
+                converted = dates.dt.date if "DateTime" not in column_type else dates.dt.to_pydatetime()
+                df[column] = pd.Series(converted, index=df.index, dtype=object).where(dates.notna(), None)
+            elif "String" in column_type:
+                df[column] = values.map(lambda x: x if isinstance(x, str) or pd.isna(x) else str(x))
+            else:
+                df[column] = values
+        return normalize_nulls(df)
+
+    def insert(self, batch: DataFrame) -> None:
+        batch = self.convert_types(batch)
+        self.batches += 1
+        token: str = hashlib.sha1(
+            f"{os.path.basename(self.output_file_path)}:{self.batches}:"
+            f"{pd.util.hash_pandas_object(batch.astype(str), index=False).sum()}".encode()
+        ).hexdigest()
+        for attempt in range(INSERT_ATTEMPTS):
+            try:
+                self.client.insert_df(self.table, batch, settings={"insert_deduplication_token": token})
+                logger.info(f"Inserted {len(batch)} rows into {self.table}")
+                return
+            except Exception as ex:
+                if attempt + 1 == INSERT_ATTEMPTS:
+                    raise
+                logger.error(f"Error inserting into {self.table}, attempt {attempt + 1} : {ex}")
+                count("insert_retries")
+                time.sleep(INSERT_BACKOFF * 2 ** attempt)
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if self.fallback is not None:
+            self.fallback.__exit__(exc_type, exc_value, traceback)
+        return False
+
+
+def get_writer(output_file_path: str, table: str, output_sink: str = OUTPUT_SINK):
+    """
+    Get the writer of the parsed rows: the json file or the table of ClickHouse.
+    """
+    if output_sink == "clickhouse":
+        return ClickHouseWriter(output_file_path, table)
+    return JsonWriter(output_file_path)
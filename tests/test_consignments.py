@@ -0,0 +1,167 @@
+import time
+import threading
+import consignments
+import pytest
+from consignments import CircuitBreaker, ConsignmentsCache, ConsignmentsClient, DeferredLookups
+
+
+def get_open_breaker(probe_timeout: float = 5) -> CircuitBreaker:
+    breaker: CircuitBreaker = CircuitBreaker(threshold=2, reset_timeout=0.05, probe_timeout=probe_timeout)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    return breaker
+
+
+def allow_in_threads(breaker: CircuitBreaker, number: int) -> tuple:
+    results: list = []
+    threads: list = [threading.Thread(target=lambda: results.append(breaker.allow())) for _ in range(number)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_breaker_opens_and_lets_one_probe_through():
+    breaker: CircuitBreaker = get_open_breaker()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_callers_wait_for_the_probe_success():
+    breaker: CircuitBreaker = get_open_breaker()
+    assert breaker.allow()
+    threads, results = allow_in_threads(breaker, 4)
+    time.sleep(0.05)
+    assert results == []
+    breaker.record_success()
+    for thread in threads:
+        thread.join(1)
+    assert results == [True] * 4
+
+
+def test_breaker_callers_wait_for_the_probe_failure():
+    breaker: CircuitBreaker = get_open_breaker()
+    assert breaker.allow()
+    threads, results = allow_in_threads(breaker, 4)
+    time.sleep(0.02)
+    breaker.record_failure()
+    for thread in threads:
+        thread.join(1)
+    assert results == [False] * 4
+
+
+def test_breaker_probes_again_after_a_lost_probe():
+    breaker: CircuitBreaker = get_open_breaker(probe_timeout=0.05)
+    assert breaker.allow()
+    start: float = time.monotonic()
+    assert breaker.allow()
+    assert time.monotonic() - start >= 0.04
+
+
+class FakeResponse(object):
+    def __init__(self, port: str):
+        self.port: str = port
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self) -> str:
+        return self.port
+
+
+class FakeSession(object):
+    """
+    Answers slowly with the port of the consignment.
+    """
+
+    def post(self, url: str, data: str, timeout: float) -> FakeResponse:
+        time.sleep(0.05)
+        return FakeResponse(f"PORT-{data}")
+
+
+def test_lookup_after_the_service_is_back():
+    client: ConsignmentsClient = ConsignmentsClient(url="http://consignments", workers=5, breaker=get_open_breaker())
+    client.session = FakeSession()
+    bodies: list = [{"line": "SINOKOR", "consignment": f"BL{i}", "direction": "export"} for i in range(5)]
+    assert [answered for _, answered in client.lookup(bodies)] == [True] * 5
+
+
+def add_rows(deferred: DeferredLookups, values: list) -> None:
+    deferred.add([({"line": "SINOKOR", "consignment": value, "direction": "export"}, "a.xlsx", "consignment", value)
+                  for value in values])
+
+
+def test_deferred_lookups_drop_the_oldest_rows(tmp_path, monkeypatch):
+    counts: dict = {}
+    monkeypatch.setattr(consignments, "count", lambda name, value=1: counts.update({name: value}))
+    deferred: DeferredLookups = DeferredLookups(str(tmp_path / "state" / "deferred.sqlite3"), max_size=3)
+    add_rows(deferred, ["BL1", "BL2"])
+    time.sleep(0.01)
+    add_rows(deferred, ["BL3", "BL4", "BL5"])
+    assert [row[4] for row in deferred.take(10)] == ["BL3", "BL4", "BL5"]
+    assert counts == {"deferred_dropped": 2}
+
+
+def test_deferred_lookups_give_up_after_max_attempts(tmp_path):
+    deferred: DeferredLookups = DeferredLookups(str(tmp_path / "deferred.sqlite3"))
+    add_rows(deferred, ["BL1", "BL2"])
+    first: list = deferred.take(1)
+    deferred.postpone(first)
+    assert [row[4] for row in deferred.take(10, max_attempts=2)] == ["BL2", "BL1"]
+    deferred.postpone(first)
+    assert [row[4] for row in deferred.take(10, max_attempts=2)] == ["BL2"]
+    assert [row[4] for row in deferred.take(10)] == ["BL2"]
+
+
+def get_body(consignment: str) -> dict:
+    return {"line": "SINOKOR", "consignment": consignment, "direction": "export"}
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list:
+    now: list = [1000.0]
+    monkeypatch.setattr(consignments.time, "time", lambda: now[0])
+    return now
+
+
+def test_cache_expires_ports_and_negative_results(tmp_path, clock):
+    cache: ConsignmentsCache = ConsignmentsCache(str(tmp_path / "cache.sqlite3"), ttl=100, negative_ttl=10)
+    cache.set_many([(get_body("BL1"), "PORT-1"), (get_body("BL2"), None)])
+    keys: list = [ConsignmentsCache.get_key(get_body(consignment)) for consignment in ("BL1", "BL2")]
+    assert cache.get_many([get_body("BL1"), get_body("BL2")]) == {keys[0]: "PORT-1", keys[1]: None}
+    clock[0] += 11
+    assert cache.get_many([get_body("BL1"), get_body("BL2")]) == {keys[0]: "PORT-1"}
+    clock[0] += 90
+    assert cache.get_many([get_body("BL1"), get_body("BL2")]) == {}
+
+
+def test_cache_evicts_the_least_recently_used(tmp_path, clock):
+    cache: ConsignmentsCache = ConsignmentsCache(str(tmp_path / "cache.sqlite3"), max_size=2)
+    cache.set_many([(get_body("BL1"), "PORT-1")])
+    clock[0] += 1
+    cache.set_many([(get_body("BL2"), "PORT-2")])
+    clock[0] += 1
+    cache.get_many([get_body("BL1")])
+    clock[0] += 1
+    cache.set_many([(get_body("BL3"), "PORT-3")])
+    found: dict = cache.get_many([get_body(consignment) for consignment in ("BL1", "BL2", "BL3")])
+    assert sorted(found.values()) == ["PORT-1", "PORT-3"]
+
+
+def test_lookup_uses_the_cache(tmp_path):
+    cache: ConsignmentsCache = ConsignmentsCache(str(tmp_path / "cache.sqlite3"))
+    cache.set_many([(get_body("BL1"), "PORT-1"), (get_body("BL2"), None)])
+    client: ConsignmentsClient = ConsignmentsClient(url="http://consignments", cache=cache)
+    client.session = FakeSession()
+    results: list = client.lookup([get_body("BL1"), get_body("BL2"), get_body("BL3")])
+    assert results[:2] == [("PORT-1", True), (None, True)]
+    assert results[2][1] and results[2][0].startswith("PORT-")
+    assert len(cache.get_many([get_body("BL3")])) == 1
+    assert client.lookup([get_body("BL4")], fetch=False) == [(None, False)]
@@ -0,0 +1,30 @@
+import pandas as pd
+from dates import convert_column, date_from_file_name
+
+DATE_FORMATS: tuple = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%d.%m.%Y")
+
+
+def test_convert_column_mixed_formats():
+    column = pd.Series(["2024-01-01 10:00:00", "2024-12-15", "15.12.2024", "", None])
+    assert convert_column(column, DATE_FORMATS).tolist() == ["2024-01-01", "2024-12-15", "2024-12-15", None, None]
+
+
+def test_convert_column_rejects_partial_iso_dates():
+    column = pd.Series(["2024-01-01 10:00:00", "2024", "20240105", "2024-12-15"])
+    assert convert_column(column, DATE_FORMATS).tolist() == ["2024-01-01", None, None, "2024-12-15"]
+
+
+def test_convert_column_keeps_the_index():
+    column = pd.Series(["01.02.2024", "not a date"], index=[10, 20])
+    result = convert_column(column, DATE_FORMATS)
+    assert result.to_dict() == {10: "2024-02-01", 20: None}
+
+
+def test_convert_column_datetimes():
+    column = pd.Series(pd.to_datetime(["2024-03-04 12:00", None]))
+    assert convert_column(column, DATE_FORMATS).tolist() == ["2024-03-04", None]
+
+
+def test_date_from_file_name():
+    assert str(date_from_file_name("/data/2024.01 export.xlsx")) == "2024-01-01"
+    assert date_from_file_name("/data/export.xlsx") is None
@@ -0,0 +1,71 @@
+import enrichment
+import pytest
+from consignments import DeferredLookups
+
+
+class FakeLookups(object):
+    """
+    Answers every lookup but the consignment UNKNOWN.
+    """
+
+    def lookup(self, bodies: list, fetch: bool = True) -> list:
+        return [(None, False) if body["consignment"] == "UNKNOWN" else (f"PORT-{body['consignment']}", True)
+                for body in bodies]
+
+
+class FakeResult(object):
+    def __init__(self, result_rows: list):
+        self.result_rows: list = result_rows
+
+
+class FakeClickHouse(object):
+    """
+    The table has the rows of the file loaded.xlsx only.
+    """
+
+    def __init__(self):
+        self.commands: list = []
+
+    def query(self, query: str, settings: dict = None) -> FakeResult:
+        if "'loaded.xlsx'" not in query:
+            return FakeResult([])
+        return FakeResult([(value,) for value in ("A1", "O'NEIL") if enrichment.quote(value) in query])
+
+    def command(self, query: str, settings: dict = None) -> None:
+        self.commands.append(query)
+
+
+@pytest.fixture
+def deferred(tmp_path, monkeypatch) -> DeferredLookups:
+    queue: DeferredLookups = DeferredLookups(str(tmp_path / "deferred.sqlite3"))
+    queue.add([
+        ({"line": "SINOKOR", "consignment": consignment, "direction": "export"}, file_name, "consignment", consignment)
+        for file_name, consignment in (("loaded.xlsx", "A1"), ("loaded.xlsx", "O'NEIL"), ("loaded.xlsx", "UNKNOWN"),
+                                       ("not_loaded.xlsx", "B1"))
+    ])
+    monkeypatch.setattr(enrichment, "get_deferred_lookups", lambda: queue)
+    monkeypatch.setattr(enrichment, "get_consignments_client", lambda: FakeLookups())
+    return queue
+
+
+def get_attempts(deferred: DeferredLookups) -> dict:
+    return dict(deferred.connection.execute("SELECT value, attempts FROM deferred").fetchall())
+
+
+def test_run_batch_removes_only_the_applied_rows(deferred, monkeypatch):
+    clickhouse: FakeClickHouse = FakeClickHouse()
+    monkeypatch.setattr(enrichment, "get_clickhouse", lambda: clickhouse)
+    worker = enrichment.EnrichmentWorker(sink="clickhouse", batch_size=10, delay=0)
+    assert worker.run_batch() == 4
+    assert get_attempts(deferred) == {"UNKNOWN": 1, "B1": 1}
+    assert len(clickhouse.commands) == 1
+    assert "original_file_name = 'loaded.xlsx' AND consignment IN ('A1', 'O\\'NEIL')" in clickhouse.commands[0]
+    assert "consignment = 'O\\'NEIL', 'PORT-O\\'NEIL'" in clickhouse.commands[0]
+
+
+def test_run_batch_json_keeps_the_queue(deferred, monkeypatch, tmp_path):
+    monkeypatch.setattr(enrichment, "ENRICHMENT_OUTPUT_PATH", str(tmp_path / "patches"))
+    worker = enrichment.EnrichmentWorker(sink="json", batch_size=10, delay=0)
+    worker.run()
+    assert get_attempts(deferred) == {"A1": 0, "O'NEIL": 0, "UNKNOWN": 0, "B1": 0}
+    assert len(list((tmp_path / "patches").iterdir())) == 1
@@ -0,0 +1,40 @@
+import pandas as pd
+from fingerprints import RowFingerprints, get_lineage
+
+
+def get_df(file_name: str, rows: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        "consignment": [consignment for consignment, _ in rows],
+        "goods_name": [goods_name for _, goods_name in rows],
+        "original_file_name": [file_name] * len(rows),
+    })
+
+
+def process(path: str, file_name: str, rows: list) -> list:
+    fingerprints: RowFingerprints = RowFingerprints(f"/data/{file_name}", path)
+    changed: pd.DataFrame = fingerprints.filter_changed(get_df(file_name, rows))
+    fingerprints.commit()
+    return list(zip(changed["consignment"], changed["goods_name"]))
+
+
+def test_get_lineage():
+    assert get_lineage("/data/2024.01 export (2).xlsx") == "2024.01 export"
+    assert get_lineage("/data/2024.01 export_копия.xlsx") == "2024.01 export"
+    assert get_lineage("/data/2024.01 export v3.xls") == "2024.01 export"
+
+
+def test_filter_changed_across_restarts(tmp_path):
+    path: str = str(tmp_path / "state" / "fingerprints.sqlite3")
+    rows: list = [("BL1", "ГРУЗ"), ("BL2", "ПОРОЖНИЙ"), ("BL3", "")]
+    assert process(path, "2024.01 export.xlsx", rows) == rows
+    assert process(path, "2024.01 export (1).xlsx", rows) == []
+    changed: list = [("BL1", "ГРУЗ"), ("BL2", "ДРУГОЙ ГРУЗ"), ("BL3", ""), ("BL4", "ГРУЗ")]
+    assert process(path, "2024.01 export (2).xlsx", changed) == [("BL2", "ДРУГОЙ ГРУЗ"), ("BL4", "ГРУЗ")]
+    assert process(path, "2024.01 export (3).xlsx", rows) == [("BL2", "ПОРОЖНИЙ")]
+
+
+def test_filter_changed_by_lineage(tmp_path):
+    path: str = str(tmp_path / "fingerprints.sqlite3")
+    rows: list = [("BL1", "ГРУЗ")]
+    assert process(path, "2024.01 export.xlsx", rows) == rows
+    assert process(path, "2024.02 export.xlsx", rows) == rows
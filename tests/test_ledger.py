@@ -0,0 +1,66 @@
+import os
+import functools
+import daemon
+import pytest
+from ledger import Ledger, file_digest
+
+
+class FakeParser(object):
+    """
+    Counts the parsed files, fails on the files whose content is broken.
+    """
+    parsed: list = []
+
+    def __init__(self, input_file_path: str, output_folder: str):
+        self.input_file_path: str = input_file_path
+
+    def main(self) -> None:
+        with open(self.input_file_path) as file:
+            if file.read() == "broken":
+                raise ValueError("broken file")
+        FakeParser.parsed.append(self.input_file_path)
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch) -> daemon.Source:
+    monkeypatch.setattr(daemon, "Ledger", functools.partial(Ledger, str(tmp_path / "state" / "ledger.sqlite3")))
+    monkeypatch.setattr(FakeParser, "parsed", [])
+    watched = tmp_path / "watched"
+    watched.mkdir()
+    source: daemon.Source = daemon.Source("test", str(watched), FakeParser, 0)
+    source.prepare()
+    return source
+
+
+def put_file(source: daemon.Source, name: str, content: str) -> str:
+    file_path: str = os.path.join(source.xls_path, name)
+    with open(file_path, "w") as file:
+        file.write(content)
+    return file_path
+
+
+def test_find_done_after_a_restart(tmp_path):
+    path: str = str(tmp_path / "ledger.sqlite3")
+    ledger: Ledger = Ledger(path)
+    file_id: int = ledger.start("digest", 10, "Export", "/data", "a.xlsx")
+    assert Ledger(path).find_done("digest", "Export") is None
+    ledger.finish(file_id, "done")
+    assert Ledger(path).find_done("digest", "Export")[1:3] == ("/data", "a.xlsx")
+    assert Ledger(path).find_done("digest", "Report_Order") is None
+
+
+def test_process_file_skips_the_same_content(source):
+    assert daemon.process_file(source, put_file(source, "a.xlsx", "rows"))
+    assert daemon.process_file(source, put_file(source, "b.xlsx", "rows"))
+    assert daemon.process_file(source, put_file(source, "c.xlsx", "other rows"))
+    assert [os.path.basename(path) for path in FakeParser.parsed] == ["a.xlsx", "c.xlsx"]
+    assert sorted(os.listdir(source.done_path)) == ["a.xlsx", "b.xlsx", "c.xlsx"]
+
+
+def test_process_file_does_not_skip_failed_files(source):
+    file_path: str = put_file(source, "a.xlsx", "broken")
+    digest: str = file_digest(file_path)
+    assert not daemon.process_file(source, file_path)
+    assert daemon.Ledger().find_done(digest, "FakeParser") is None
+    assert not daemon.process_file(source, put_file(source, "b.xlsx", "broken"))
+    assert sorted(os.listdir(source.xls_path)) == ["done", "error_a.xlsx", "error_b.xlsx", "json"]
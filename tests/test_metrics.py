@@ -0,0 +1,35 @@
+import metrics
+import pytest
+from metrics import count, measured, reset_peak_rss
+
+
+class FakeParser(object):
+    def __init__(self, input_file_path: str, megabytes: int):
+        self.input_file_path: str = input_file_path
+        self.megabytes: int = megabytes
+
+    @measured
+    def main(self) -> None:
+        data: bytearray = bytearray(self.megabytes * 1024 * 1024)
+        count("consignments_requests", len(data) // (1024 * 1024))
+
+
+def test_peak_rss_is_measured_per_file():
+    if not reset_peak_rss():
+        pytest.skip("the peak of the memory can not be reset")
+    FakeParser("big.xlsx", 200).main()
+    big: dict = metrics.last_record
+    FakeParser("small.xlsx", 1).main()
+    small: dict = metrics.last_record
+    assert big["peak_rss_bytes"] - small["peak_rss_bytes"] > 150 * 1024 * 1024
+    assert small["process_peak_rss_bytes"] >= big["peak_rss_bytes"]
+    assert (big["counters"], small["counters"]) == ({"consignments_requests": 200}, {"consignments_requests": 1})
+
+
+def test_write_textfile(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TEXTFILE_DIR", str(tmp_path))
+    FakeParser("a.xlsx", 1).main()
+    lines: list = (tmp_path / "export_scripts_fakeparser.prom").read_text().splitlines()
+    assert 'export_scripts_file_success{parser="FakeParser"} 1' in lines
+    assert 'export_scripts_events{parser="FakeParser",event="consignments_requests"} 1' in lines
+    assert any(line.startswith('export_scripts_process_peak_rss_bytes{parser="FakeParser"} ') for line in lines)
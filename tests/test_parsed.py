@@ -0,0 +1,61 @@
+import pandas as pd
+import parsed
+import pytest
+
+PORT_COLUMNS: list = ["tracking_seaport", "is_auto_tracking", "is_auto_tracking_ok"]
+
+
+class FakeClient(object):
+    """
+    Answers every lookup but the consignment UNKNOWN, which stays unanswered.
+    """
+
+    def __init__(self):
+        self.bodies: list = []
+
+    def lookup(self, bodies: list, fetch: bool = True) -> list:
+        self.bodies.extend(bodies)
+        return [(None, False) if body["consignment"] == "UNKNOWN" else (f"PORT-{body['consignment']}", True)
+                for body in bodies]
+
+
+@pytest.fixture
+def client(monkeypatch) -> FakeClient:
+    reference_lines = parsed.ReferenceLines()
+    reference_lines.use_snapshot([("SINOKOR", "SINOKOR"), ("СИНОКОР РУС ООО", "SINOKOR")])
+    fake_client: FakeClient = FakeClient()
+    monkeypatch.setattr(parsed, "REFERENCE_LINES", reference_lines)
+    monkeypatch.setattr(parsed, "get_consignments_client", lambda: fake_client)
+    monkeypatch.setattr(parsed, "get_deferred_lookups", lambda: None)
+    return fake_client
+
+
+def get_chunk(lines: list, consignments: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        "line": lines,
+        "consignment": consignments,
+        "goods_name": [None] * len(lines),
+        "original_file_name": ["2024.01 export.xlsx"] * len(lines),
+    })
+
+
+def test_write_ports_same_columns_in_every_chunk(client):
+    chunks: list = [
+        get_chunk(["SINOKOR", "СИНОКОР РУС ООО", "SINOKOR"], ["A1", "A2", "UNKNOWN"]),
+        get_chunk(["OTHER LINE", "OTHER LINE"], ["B1", "B2"]),
+        get_chunk([], []),
+    ]
+    for chunk in chunks:
+        parsed.ParsedDf(chunk).get_port()
+    assert [chunk.columns.tolist() for chunk in chunks[1:]] == [chunks[0].columns.tolist()] * 2
+    assert set(PORT_COLUMNS) <= set(chunks[0].columns)
+    assert all(chunk[column].dtype == object for chunk in chunks for column in PORT_COLUMNS)
+
+
+def test_write_ports_values(client):
+    df: pd.DataFrame = get_chunk(["SINOKOR", "СИНОКОР РУС ООО", "SINOKOR", "OTHER LINE"], ["A1", "A1", "UNKNOWN", "B1"])
+    parsed.ParsedDf(df).get_port()
+    assert df["tracking_seaport"].tolist() == ["PORT-A1", "PORT-A1", None, None]
+    assert df["is_auto_tracking"].tolist() == [True, True, True, None]
+    assert df["is_auto_tracking_ok"].tolist() == [True, True, False, None]
+    assert [body["consignment"] for body in client.bodies] == ["A1", "UNKNOWN"]
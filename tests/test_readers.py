@@ -0,0 +1,76 @@
+import openpyxl
+import pandas as pd
+from openpyxl.styles import PatternFill
+from readers import read_excel_chunks, read_sheets
+from schema import HeaderMapper
+
+HEADER_MAPPER: HeaderMapper = HeaderMapper({"Контейнер": "container", "Номер": "number", "Тип": "type"})
+DATA: list = [("Контейнер", "Номер", "Тип")] + [(f"ABCU{i:07d}", i, "40HC") for i in range(7)]
+
+
+def open_sheets(*sheets):
+    return lambda: ((name, iter(rows)) for name, rows in sheets)
+
+
+def read(*sheets, chunk_size: int = 3, header_mapper=HEADER_MAPPER) -> list:
+    return list(read_sheets(open_sheets(*sheets), chunk_size, 0, None, header_mapper))
+
+
+def test_read_sheets_in_chunks():
+    chunks = read(("data", DATA))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    df = pd.concat(chunks, ignore_index=True)
+    assert list(df.columns) == ["Контейнер", "Номер", "Тип"]
+    assert df["Номер"].tolist() == list(range(7))
+
+
+def test_read_sheets_skips_summary_sheets():
+    summary: list = [("Контейнер", "Итого"), ("Всего", 7)]
+    chunks = read(("summary", summary), ("data", DATA), ("empty", []), ("more", DATA[:3]))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1, 2]
+    assert all(list(chunk.columns) == ["Контейнер", "Номер", "Тип"] for chunk in chunks)
+
+
+def test_read_sheets_first_sheet_with_missing_columns():
+    chunks = read(("data", [row[:2] for row in DATA]), ("summary", [("Контейнер",), ("ABCU0000001",)]))
+    assert sum(len(chunk) for chunk in chunks) == 7
+
+
+def test_read_sheets_falls_back_to_the_first_sheet():
+    chunks = read(("cover", [("Отчет",), ("за январь",)]), ("notes", [("Итого", "Всего")]))
+    assert [chunk.columns.tolist() for chunk in chunks] == [["Отчет"]]
+
+
+def test_read_sheets_without_header_mapper():
+    chunks = read(("empty", []), ("data", DATA), ("more", DATA), header_mapper=None)
+    assert sum(len(chunk) for chunk in chunks) == 7
+
+
+def test_read_sheets_without_rows():
+    chunks = read(("data", DATA[:1]))
+    assert len(chunks) == 1 and chunks[0].empty and list(chunks[0].columns) == ["Контейнер", "Номер", "Тип"]
+
+
+def test_read_sheets_trims_empty_trailing_cells_and_rows():
+    sheet: list = [row + (None, "") for row in DATA] + [(None, None, None, "", None)] * 2
+    chunks = read(("data", sheet))
+    df = pd.concat(chunks, ignore_index=True)
+    assert list(df.columns) == ["Контейнер", "Номер", "Тип"]
+    assert len(df) == 7
+
+
+def test_read_excel_chunks_styled_empty_cells(tmp_path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in DATA:
+        sheet.append(row)
+    sheet.append(())
+    sheet.append(("ABCU0000099", 99, "20DC"))
+    fill: PatternFill = PatternFill("solid", fgColor="FFFF00")
+    for row in range(1, len(DATA) + 6):
+        for column in (4, 5):
+            sheet.cell(row=row, column=column).fill = fill
+    file_path: str = str(tmp_path / "styled.xlsx")
+    workbook.save(file_path)
+    df = pd.concat(read_excel_chunks(file_path, chunk_size=3, header_mapper=HEADER_MAPPER), ignore_index=True)
+    pd.testing.assert_frame_equal(df, pd.read_excel(file_path), check_dtype=False)
@@ -0,0 +1,87 @@
+import pandas as pd
+import pytest
+import report_orders_update
+from report_orders_update import OPTIONAL_COLUMNS, UPDATE_COLUMNS, Report_Order_Update
+
+
+class FakeResult(object):
+    def __init__(self, result_rows: list):
+        self.result_rows: list = result_rows
+
+
+class FakeClickHouse(object):
+    """
+    Records the mutations, fails the batches when fail_batches and the rows of the uuids in failed_uuids.
+    """
+
+    def __init__(self, fail_batches: bool = False, failed_uuids: tuple = ()):
+        self.fail_batches: bool = fail_batches
+        self.failed_uuids: tuple = failed_uuids
+        self.commands: list = []
+        self.queries: list = []
+
+    def query(self, query: str) -> FakeResult:
+        if "system.columns" in query:
+            return FakeResult([(column, "Nullable(String)") for column, _ in UPDATE_COLUMNS])
+        if any(f"uuid = '{uuid}'" in query for uuid in self.failed_uuids):
+            raise ValueError("Code: 53. Type mismatch")
+        self.queries.append(query)
+        return FakeResult([])
+
+    def command(self, query: str, settings: dict = None) -> None:
+        if self.fail_batches:
+            raise ValueError("Code: 62. Max query size exceeded")
+        self.commands.append(query)
+
+
+@pytest.fixture
+def messages(monkeypatch) -> list:
+    sent: list = []
+    monkeypatch.setattr(report_orders_update, "telegram", sent.append)
+    return sent
+
+
+def get_parser(monkeypatch, clickhouse: FakeClickHouse) -> Report_Order_Update:
+    monkeypatch.setattr(report_orders_update, "get_clickhouse", lambda: clickhouse)
+    return Report_Order_Update("/data/2024.01 update.xlsx", "/data/json")
+
+
+def get_df(number: int) -> pd.DataFrame:
+    rows: list = []
+    for i in range(number):
+        row: dict = {column: f"value {i}" for column, _ in UPDATE_COLUMNS if column not in OPTIONAL_COLUMNS}
+        row.update({"uuid": f"uuid-{i}", "goods_name": "O'NEIL BOXES", "tnved": None, "container_size": 40,
+                    "container_count": 0})
+        rows.append(row)
+    return pd.DataFrame(rows, dtype=object)
+
+
+def test_clickhouse_update_batch_sql(monkeypatch, messages):
+    clickhouse: FakeClickHouse = FakeClickHouse()
+    get_parser(monkeypatch, clickhouse).update_date_in_table(get_df(2))
+    assert len(clickhouse.commands) == 1 and messages == []
+    query: str = clickhouse.commands[0]
+    assert "WHERE uuid IN ('uuid-0', 'uuid-1')" in query
+    assert ("goods_name = multiIf(uuid = 'uuid-0', CAST('O''NEIL BOXES', 'Nullable(String)'), "
+            "uuid = 'uuid-1', CAST('O''NEIL BOXES', 'Nullable(String)'), goods_name)") in query
+    assert "uuid = 'uuid-1', CAST(NULL, 'Nullable(String)')" in query.split("tnved = ")[1].split("\n")[0]
+    assert "parsed_on = multiIf(uuid = 'uuid-0', CAST(NULL, 'Nullable(String)')" in query
+    assert "container_size = multiIf(uuid = 'uuid-0', CAST(40, 'Nullable(String)')" in query
+    assert "container_count = multiIf(uuid = 'uuid-0', CAST(0, 'Nullable(String)')" in query
+
+
+def test_update_date_in_table_batches(monkeypatch, messages):
+    monkeypatch.setattr(report_orders_update, "UPDATE_BATCH_SIZE", 2)
+    clickhouse: FakeClickHouse = FakeClickHouse()
+    get_parser(monkeypatch, clickhouse).update_date_in_table(get_df(5))
+    assert [query.count("uuid = 'uuid-") // len(UPDATE_COLUMNS) for query in clickhouse.commands] == [2, 2, 1]
+
+
+def test_update_date_in_table_falls_back_to_rows(monkeypatch, messages):
+    clickhouse: FakeClickHouse = FakeClickHouse(fail_batches=True, failed_uuids=("uuid-1",))
+    get_parser(monkeypatch, clickhouse).update_date_in_table(get_df(3))
+    assert clickhouse.commands == []
+    assert [query.split("WHERE ")[1].strip() for query in clickhouse.queries] == ["uuid = 'uuid-0'", "uuid = 'uuid-2'"]
+    assert "goods_name = 'O''NEIL BOXES'" in clickhouse.queries[0]
+    assert "tnved = NULL" in clickhouse.queries[0]
+    assert len(messages) == 1 and messages[0].endswith("uuid: uuid-1")
@@ -0,0 +1,36 @@
+from schema import HeaderMapper
+
+HEADERS: dict = {
+    ("Контейнер", "Container"): "container",
+    "Номер": "number",
+    "Тип": "type",
+    "Комментарий": "comment",
+}
+
+
+def test_resolve_aliases_case_and_whitespace():
+    header_mapping = HeaderMapper(HEADERS).resolve([" container ", "НОМЕР", "Тип", "Комментарий"])
+    assert header_mapping.mapping == {
+        " container ": "container", "НОМЕР": "number", "Тип": "type", "Комментарий": "comment"
+    }
+    assert header_mapping.is_complete
+
+
+def test_resolve_every_column_required_by_default():
+    header_mapping = HeaderMapper(HEADERS).resolve(["Контейнер", "Номер", "Тип"])
+    assert header_mapping.missing == ["comment"]
+    assert header_mapping.missing_required == ["comment"]
+    assert not header_mapping.is_complete
+
+
+def test_resolve_missing_optional_columns():
+    header_mapping = HeaderMapper(HEADERS, required=("container", "number")).resolve(["Контейнер", "Номер"])
+    assert header_mapping.missing == ["type", "comment"]
+    assert header_mapping.missing_required == []
+    assert header_mapping.is_complete
+
+
+def test_resolve_unknown_columns():
+    header_mapping = HeaderMapper(HEADERS, required=("container",)).resolve(["Контейнер", "Итого"])
+    assert header_mapping.unknown == ["Итого"]
+    assert not header_mapping.is_complete
@@ -0,0 +1,31 @@
+import watcher
+import pytest
+
+MOUNTS: str = """rootfs / overlay rw 0 0
+server:/export /mnt/data nfs4 rw,relatime 0 0
+//host/share /mnt/data/smb\\040share cifs rw 0 0
+tmpfs /mnt/data/local tmpfs rw 0 0
+"""
+
+
+@pytest.fixture
+def mounts(tmp_path, monkeypatch) -> None:
+    mounts_path = tmp_path / "mounts"
+    mounts_path.write_text(MOUNTS)
+    monkeypatch.setattr(watcher, "MOUNTS_PATH", str(mounts_path))
+
+
+def test_get_filesystem(mounts):
+    assert watcher.get_filesystem("/mnt/data/lines/flat_export") == "nfs4"
+    assert watcher.get_filesystem("/mnt/data/smb share/report_orders") == "cifs"
+    assert watcher.get_filesystem("/mnt/data/local") == "tmpfs"
+    assert watcher.get_filesystem("/mnt/database") == "overlay"
+
+
+def test_start_watcher_polls_network_filesystems(mounts, tmp_path):
+    assert watcher.start_watcher([str(tmp_path), "/mnt/data/lines"], lambda file_path: None) is None
+
+
+def test_start_watcher_turned_off(monkeypatch, tmp_path):
+    monkeypatch.setattr(watcher, "INOTIFY", "0")
+    assert watcher.start_watcher([str(tmp_path)], lambda file_path: None) is None